@@ -3,33 +3,145 @@
 """yuvcommon: Common YUV/RGB code."""
 
 from array import array
+import concurrent.futures
+import contextlib
+import fnmatch
+import functools
+import numpy as np
+import os
 import sys
 
 
-PIX_FMTS = ("yuv420p", "nv12", "rgb24", "rgba", "yuv444p", "yuyv422")
+# pixel format descriptors. Each format describes its 3 components (Y, U,
+# V for yuv formats, R, G, B for rgb formats) as a (plane, offset, stride,
+# (horizontal subsampling, vertical subsampling)) tuple, where the offset
+# and stride are in bytes (all samples are 8-bit). Planes are stored
+# consecutively in the frame, and their row size is set by the first
+# component that uses them. Components missing from a format (e.g. the
+# chroma in gray) are None. Padding bytes (e.g. alpha) are not components.
+PIX_FMT_DESCRIPTORS = {
+    # planar format, 4:2:0
+    "yuv420p": {
+        "yuv": True,
+        "components": ((0, 0, 1, (1, 1)), (1, 0, 1, (2, 2)), (2, 0, 1, (2, 2))),
+    },
+    # semi-planar format, 4:2:0
+    "nv12": {
+        "yuv": True,
+        "components": ((0, 0, 1, (1, 1)), (1, 0, 2, (2, 2)), (1, 1, 2, (2, 2))),
+    },
+    # semi-planar format, 4:2:0, chromas swapped
+    "nv21": {
+        "yuv": True,
+        "components": ((0, 0, 1, (1, 1)), (1, 1, 2, (2, 2)), (1, 0, 2, (2, 2))),
+    },
+    # planar format, 4:2:2
+    "yuv422p": {
+        "yuv": True,
+        "components": ((0, 0, 1, (1, 1)), (1, 0, 1, (2, 1)), (2, 0, 1, (2, 1))),
+    },
+    # planar format, 4:4:4, no alpha channel
+    "yuv444p": {
+        "yuv": True,
+        "components": ((0, 0, 1, (1, 1)), (1, 0, 1, (1, 1)), (2, 0, 1, (1, 1))),
+    },
+    # packed format, 4:2:2, no alpha channel
+    # Y00 U00 Y01 V00  Y02 U02 Y03 V02
+    "yuyv422": {
+        "yuv": True,
+        "components": ((0, 0, 2, (1, 1)), (0, 1, 4, (2, 1)), (0, 3, 4, (2, 1))),
+    },
+    # packed format, 4:2:2, no alpha channel
+    # U00 Y00 V00 Y01  U02 Y02 V02 Y03
+    "uyvy422": {
+        "yuv": True,
+        "components": ((0, 1, 2, (1, 1)), (0, 0, 4, (2, 1)), (0, 2, 4, (2, 1))),
+    },
+    # planar format, luma only
+    "gray": {
+        "yuv": True,
+        "components": ((0, 0, 1, (1, 1)), None, None),
+    },
+    # packed format, 4:4:4, no alpha channel
+    "rgb24": {
+        "yuv": False,
+        "components": ((0, 0, 3, (1, 1)), (0, 1, 3, (1, 1)), (0, 2, 3, (1, 1))),
+    },
+    # packed format, 4:4:4, includes alpha channel
+    "rgba": {
+        "yuv": False,
+        "components": ((0, 0, 4, (1, 1)), (0, 1, 4, (1, 1)), (0, 2, 4, (1, 1))),
+    },
+    # packed format, 4:4:4, includes alpha channel, red and blue swapped
+    "bgra": {
+        "yuv": False,
+        "components": ((0, 2, 4, (1, 1)), (0, 1, 4, (1, 1)), (0, 0, 4, (1, 1))),
+    },
+}
+
+PIX_FMTS = tuple(PIX_FMT_DESCRIPTORS.keys())
+
+# value used for the components missing from a pixel format
+MISSING_COMPONENT_VALUE = 128
+
+# valid (8-bit) YUV sample values, per color range
+RANGE_LIST = ("full", "limited")
+yuv_range = {
+    "full": {
+        "ymin": 0,
+        "ymax": 255,
+        "umin": 0,
+        "umax": 255,
+        "vmin": 0,
+        "vmax": 255,
+    },
+    "limited": {
+        "ymin": 16,
+        "ymax": 235,
+        "umin": 16,
+        "umax": 240,
+        "vmin": 16,
+        "vmax": 240,
+    },
+}
+
+
+# Most of the per-component helpers accept either a scalar (python int or
+# float) or a numpy array (a whole plane). The array versions follow the
+# scalar semantics exactly (e.g. int() truncates towards zero), so that the
+# vectorized conversion engine produces the same bytes as the scalar one.
+def to_int(x):
+    if isinstance(x, np.ndarray):
+        return np.trunc(x).astype(np.int64)
+    return int(x)
+
+
+# f(x) = a * x + b, with f(x <= xmin) = ymin and f(x >= xmax) = ymax
+def scale_clip(x, a, b, xmin, xmax, ymin, ymax):
+    if isinstance(x, np.ndarray):
+        return np.where(
+            x <= xmin, ymin, np.where(x >= xmax, ymax, to_int(a * x + b))
+        )
+    if x <= xmin:
+        return ymin
+    if x >= xmax:
+        return ymax
+    return int(a * x + b)
 
 
 def scale_fr2lr_16_235(x):
     # values outside the full range are not valid
-    if x <= 0:
-        return 16
-    if x >= 255:
-        return 235
     # f(x) = a * x + b
     # f(0) = a * 0 + b = 16
     b = 16.0
     # f(255) = a * 255 + b = 235
     # a = (235 - b) / 255
     a = 0.8588235294117647
-    return int(a * x + b)
+    return scale_clip(x, a, b, 0, 255, 16, 235)
 
 
 def scale_lr2fr_16_235(x):
     # values outside the limited range are not scaled
-    if x <= 16:
-        return 16
-    if x >= 235:
-        return 235
     # f(x) = a * x + b
     # f(16) = a * 16 + b = 0
     # f(235) = a * 235 + b = 255
@@ -37,30 +149,22 @@ def scale_lr2fr_16_235(x):
     a = 1.1643835616438356
     # b = -a * 16
     b = -18.63013698630137
-    return int(a * x + b)
+    return scale_clip(x, a, b, 16, 235, 16, 235)
 
 
 def scale_fr2lr_16_240(x):
     # values outside the full range are not valid
-    if x <= 0:
-        return 16
-    if x >= 255:
-        return 240
     # f(x) = a * x + b
     # f(0) = a * 0 + b = 16
     b = 16.0
     # f(255) = a * 255 + b = 240
     # a = (240 - b) / 255
     a = 0.8784313725490196
-    return int(a * x + b)
+    return scale_clip(x, a, b, 0, 255, 16, 240)
 
 
 def scale_lr2fr_16_240(x):
     # values outside the limited range are not scaled
-    if x <= 16:
-        return 16
-    if x >= 240:
-        return 240
     # f(x) = a * x + b
     # f(16) = a * 16 + b = 0
     # f(240) = a * 240 + b = 255
@@ -68,7 +172,7 @@ def scale_lr2fr_16_240(x):
     a = 1.1383928571428572
     # b = -a * 16
     b = -18.214285714285715
-    return int(a * x + b)
+    return scale_clip(x, a, b, 16, 240, 16, 240)
 
 
 def rgb_fr2lr(r, g, b):
@@ -85,33 +189,83 @@ DO_NOT_NORMALIZE = False
 
 def normalize(val):
     if DO_NOT_NORMALIZE:
-        return int(val)
+        return to_int(val)
+    if isinstance(val, np.ndarray):
+        return to_int(np.clip(val, 0, 255))
     return 0 if val < 0 else (255 if val > 255 else int(val))
 
 
-def is_yuv(pix_fmt):
-    if pix_fmt in ("yuv420p", "nv12", "yuv444p", "yuyv422"):
-        return True
-    elif pix_fmt in ("rgb24", "rgba"):
-        return False
+def get_pix_fmt_descriptor(pix_fmt):
+    if pix_fmt in PIX_FMT_DESCRIPTORS:
+        return PIX_FMT_DESCRIPTORS[pix_fmt]
     # unsupported pix_fmt
     print("error: unsupported format: %s" % pix_fmt)
     sys.exit(-1)
 
 
+def is_yuv(pix_fmt):
+    return get_pix_fmt_descriptor(pix_fmt)["yuv"]
+
+
 # get frame size/luma size ratio
 def get_length_factor(pix_fmt):
-    if pix_fmt in ("yuv420p", "nv12"):
-        return 1.5
-    elif pix_fmt in ("yuyv422"):
-        return 2
-    elif pix_fmt in ("yuv444p", "rgb24"):
-        return 3
-    elif pix_fmt in ("rgba"):
-        return 4
-    # unsupported pix_fmt
-    print("error: unsupported format: %s" % pix_fmt)
-    sys.exit(-1)
+    length_factor = 0
+    planes = set()
+    for component in get_pix_fmt_descriptor(pix_fmt)["components"]:
+        if component is None or component[0] in planes:
+            continue
+        plane, _, stride, (sx, sy) = component
+        planes.add(plane)
+        length_factor += stride / (sx * sy)
+    return length_factor
+
+
+# get the layout of a frame: for each component, a (start, row_size,
+# offset, stride, (horizontal subsampling, vertical subsampling)) tuple,
+# where start is the location of the component plane in the frame, and
+# row_size is its size in bytes. None for missing components
+@functools.lru_cache(maxsize=64)
+def get_layout(w, h, pix_fmt):
+    components = get_pix_fmt_descriptor(pix_fmt)["components"]
+    # get the plane row sizes and heights
+    plane_sizes = {}
+    for component in components:
+        if component is None:
+            continue
+        plane, _, stride, (sx, sy) = component
+        plane_sizes.setdefault(plane, ((w // sx) * stride, h // sy))
+    # planes are stored consecutively
+    plane_starts = {}
+    start = 0
+    for plane in sorted(plane_sizes):
+        plane_starts[plane] = start
+        row_size, rows = plane_sizes[plane]
+        start += row_size * rows
+    return tuple(
+        None
+        if component is None
+        else (
+            plane_starts[component[0]],
+            plane_sizes[component[0]][0],
+            *component[1:],
+        )
+        for component in components
+    )
+
+
+# get the frame size, as the sum of its plane sizes. Unlike
+# `w * h * get_length_factor()`, it is exact for odd sizes of subsampled
+# formats (e.g. a 15x9 nv12 frame has a 15x9 luma and a 14x4 chroma plane)
+def get_frame_size(w, h, pix_fmt):
+    frame_size = 0
+    planes = set()
+    for component in get_layout(w, h, pix_fmt):
+        if component is None or component[0] in planes:
+            continue
+        start, row_size, _, _, (_, sy) = component
+        planes.add(start)
+        frame_size += row_size * (h // sy)
+    return frame_size
 
 
 def read_image(infile, w, h, pix_fmt, frame_number=0):
@@ -126,42 +280,200 @@ def read_image(infile, w, h, pix_fmt, frame_number=0):
     return data
 
 
-def get_component_locations(i, j, w, h, pix_fmt):
-    if pix_fmt == "yuv420p":
-        # planar format, 4:2:0
-        return (
-            (w * j) + i,
-            (w * h) + ((w // 2) * (j // 2)) + (i // 2),
-            (w * h) + ((w // 2) * (h // 2)) + ((w // 2) * (j // 2)) + (i // 2),
-        )
-    elif pix_fmt == "nv12":
-        # semi-planar format, 4:2:0
-        return (
-            (w * j) + i,
-            (w * h) + ((w // 2) * 2 * (j // 2)) + 2 * (i // 2),
-            (w * h) + ((w // 2) * 2 * (j // 2)) + 2 * (i // 2) + 1,
-        )
-    elif pix_fmt == "yuv444p":
-        # planar format, 4:4:4, no alpha channel
-        return ((w * j) + i, (w * h) + (w * j) + i, 2 * (w * h) + (w * j) + i)
-    elif pix_fmt == "yuyv422":
-        # packed format, 4:2:2, no alpha channel
-        # Y00 U00 Y01 V00  Y02 U02 Y03 V02
-        first_luma_in_group = i % 2 == 0
-        u_shift = +1 if first_luma_in_group else -1
-        v_shift = +3 if first_luma_in_group else +1
-        return (
-            (w * j * 2) + i * 2,
-            (w * j * 2) + i * 2 + u_shift,
-            (w * j * 2) + i * 2 + v_shift,
-        )
-    elif pix_fmt == "rgb24":
-        # packed format, 4:4:4, no alpha channel
-        return ((w * j * 4) + i * 4, (w * j * 4) + i * 4 + 1, (w * j * 4) + i * 4 + 2)
-    elif pix_fmt == "rgba":
-        # packed format, 4:4:4, includes alpha channel
-        return ((w * j * 4) + i * 4, (w * j * 4) + i * 4 + 1, (w * j * 4) + i * 4 + 2)
-    else:
-        # unsupported pix_fmt
-        print("error: unsupported format: %s" % pix_fmt)
+# memory-mapped access to a raw (multi-frame) video file: returns a
+# read-only (num_frames, frame_size) uint8 array, where each frame is a
+# zero-copy view that is paged in on demand. A trailing partial frame is
+# ignored
+def map_video(infile, w, h, pix_fmt):
+    frame_size = int(w * h * get_length_factor(pix_fmt))
+    num_frames = os.path.getsize(infile) // frame_size
+    if num_frames == 0:
+        # np.memmap cannot map empty files
+        return np.zeros((0, frame_size), dtype=np.uint8)
+    return np.memmap(infile, dtype=np.uint8, mode="r", shape=(num_frames, frame_size))
+
+
+# memory-mapped version of read_image(): returns the frame as a zero-copy
+# uint8 array
+def map_image(infile, w, h, pix_fmt, frame_number=0):
+    video = map_video(infile, w, h, pix_fmt)
+    if frame_number >= len(video):
+        print("error: cannot read frame %i from %s" % (frame_number, infile))
         sys.exit(-1)
+    return video[frame_number]
+
+
+# memory-mapped version of read_frames(): returns the frames in
+# range(start, end, step) as zero-copy uint8 arrays. Requires a regular
+# (seekable) file
+def map_frames(infile, w, h, pix_fmt, start=0, end=None, step=1):
+    return map_video(infile, w, h, pix_fmt)[start:end:step]
+
+
+# open a file for binary I/O, where "-" means stdin (read) or stdout (write)
+def open_file(filename, mode):
+    if filename == "-":
+        stream = sys.stdin if "r" in mode else sys.stdout
+        return contextlib.nullcontext(stream.buffer)
+    return open(filename, mode)
+
+
+# parse a frame range ("all", "START:END:STEP", or "START:END"), using the
+# python slice syntax (empty fields take their default values). Returns
+# a (start, end, step) tuple, where end is None for "until the last frame"
+def parse_frame_range(frames):
+    if frames == "all":
+        return 0, None, 1
+    fields = frames.split(":")
+    try:
+        if len(fields) not in (2, 3):
+            raise ValueError
+        start = int(fields[0]) if fields[0] else 0
+        end = int(fields[1]) if fields[1] else None
+        step = int(fields[2]) if len(fields) == 3 and fields[2] else 1
+    except ValueError:
+        print("error: invalid frame range: %s" % frames)
+        sys.exit(-1)
+    if start < 0 or (end is not None and end < 0) or step < 1:
+        print("error: invalid frame range: %s" % frames)
+        sys.exit(-1)
+    return start, end, step
+
+
+# frame generator for multi-frame videos: yields the frames in
+# range(start, end, step) as arrays, stopping at the end of the file (a
+# trailing partial frame is ignored). Keeps one frame in memory, and
+# works with non-seekable inputs (e.g. stdin in a pipe)
+def read_frames(infile, w, h, pix_fmt, start=0, end=None, step=1):
+    frame_size = int(w * h * get_length_factor(pix_fmt))
+    with open_file(infile, "rb") as fin:
+        seekable = fin.seekable()
+        # number of the next frame in the file
+        cur_frame_number = 0
+        frame_number = start
+        while end is None or frame_number < end:
+            # skip to the requested frame
+            if seekable:
+                if frame_number != cur_frame_number:
+                    fin.seek(frame_number * frame_size)
+            else:
+                while cur_frame_number < frame_number:
+                    if len(fin.read(frame_size)) < frame_size:
+                        return
+                    cur_frame_number += 1
+            buf = fin.read(frame_size)
+            if len(buf) < frame_size:
+                return
+            cur_frame_number = frame_number + 1
+            data = array("B")
+            data.frombytes(buf)
+            yield data
+            frame_number += step
+
+
+# get the locations of the 3 components of pixel (i, j) in a frame (None
+# for missing components)
+def get_component_locations(i, j, w, h, pix_fmt):
+    locations = []
+    for component in get_layout(w, h, pix_fmt):
+        if component is None:
+            locations.append(None)
+            continue
+        start, row_size, offset, stride, (sx, sy) = component
+        locations.append(start + (j // sy) * row_size + (i // sx) * stride + offset)
+    return tuple(locations)
+
+
+# get chroma subsampling factors (horizontal, vertical)
+def get_chroma_subsampling(pix_fmt):
+    component = get_pix_fmt_descriptor(pix_fmt)["components"][1]
+    if component is None:
+        return 1, 1
+    return component[3]
+
+
+# get (numpy) views of the 3 components of a frame. Chroma planes are
+# returned at their native (subsampled) resolution. Views share memory
+# with the frame, so writing into them writes into the frame. Missing
+# components are returned as (scratch) planes set to
+# MISSING_COMPONENT_VALUE.
+def get_planes(frame, w, h, pix_fmt):
+    planes = []
+    for component in get_layout(w, h, pix_fmt):
+        if component is None:
+            planes.append(np.full((h, w), MISSING_COMPONENT_VALUE, dtype=np.uint8))
+            continue
+        start, row_size, offset, stride, (sx, sy) = component
+        cw, ch = w // sx, h // sy
+        plane = frame[start : start + row_size * ch].reshape(ch, row_size)
+        planes.append(plane[:, offset : offset + cw * stride : stride])
+    return planes
+
+
+# on-disk cache eviction: remove the least-recently used (oldest mtime)
+# cache_dir entries whose names match `pattern` until they add up to at
+# most max_size bytes, keeping the `keep_path` entry
+def evict_cache(cache_dir, max_size, pattern, keep_path=None):
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if fnmatch.fnmatch(entry.name, pattern):
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        if path == keep_path:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+
+
+# write a file atomically: yields a temporary file (next to path), which
+# replaces path when the block completes, and is removed if it fails (so
+# readers never see a partial file)
+@contextlib.contextmanager
+def atomic_write(path, mode="wb"):
+    tmp_path = "%s.%i.tmp" % (path, os.getpid())
+    try:
+        with open(tmp_path, mode) as fout:
+            yield fout
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+# add the --jobs CLI option (the number of process pool workers used for
+# `what`)
+def add_jobs_argument(parser, default, what):
+    parser.add_argument(
+        "--jobs",
+        action="store",
+        type=int,
+        dest="jobs",
+        default=default,
+        metavar="JOBS",
+        help="number of parallel workers for %s (0 uses all the CPUs) "
+        "(default: %i)" % (what, default),
+    )
+
+
+# get the number of process pool workers for a --jobs value
+def get_num_jobs(jobs):
+    return os.cpu_count() if jobs == 0 else jobs
+
+
+# run function(*args) for each args tuple of args_list in a pool of `jobs`
+# processes, and yield the (args, result) tuples as the calls complete.
+# Worker errors (including sys.exit() calls) are propagated
+def run_in_pool(jobs, function, args_list):
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(function, *args): args for args in args_list}
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
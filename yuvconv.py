@@ -8,14 +8,19 @@ user-defined matrices.
 
 import argparse
 from array import array
+import functools
 import math
 import numpy as np
+import os
 import sys
 import yuvcommon
 
 FUNCTIONS = ["image", "pixel"]
+ENGINES = ("vector", "scalar", "lut")
+CHROMA_SITINGS = ("last", "left", "center", "topleft")
+CHROMA_UPSAMPLES = ("nearest", "bilinear", "catmullrom")
 
-PIX_FMTS = ("yuv420p", "nv12", "rgb24", "rgba", "yuv444p", "yuyv422")
+PIX_FMTS = yuvcommon.PIX_FMTS
 COLOR_RANGES = ("full", "limited")
 
 H273_MATRIX_COEFFICIENTS = {
@@ -74,9 +79,9 @@ def convert_rgb2yuv_ycbcr_sdtv_analog(R, G, B):
     Y = 0.299 * R + 0.587 * G + 0.114 * B  # NOQA: E201,E241,E221,E222
     Pb = -0.169 * R - 0.331 * G + 0.500 * B  # NOQA: E201,E241,E221,E222
     Pr = 0.500 * R - 0.419 * G - 0.081 * B  # NOQA: E201,E241,E221,E222
-    Y = int(256 * Y)  # NOQA: E201,E241,E221
-    Cb = int(256 * Pb + 128)
-    Cr = int(256 * Pr + 128)
+    Y = yuvcommon.to_int(256 * Y)  # NOQA: E201,E241,E221
+    Cb = yuvcommon.to_int(256 * Pb + 128)
+    Cr = yuvcommon.to_int(256 * Pr + 128)
     return Y, Cb, Cr
 
 
@@ -87,9 +92,9 @@ def convert_yuv2rgb_ycbcr_sdtv_analog(Y, U, V):
     G = Y - 0.714 * Pr - 0.344 * Pb
     B = Y + 1.772 * Pb  # NOQA: E221
     # convert back to integer
-    R = int(256 * R)
-    G = int(256 * G)
-    B = int(256 * B)
+    R = yuvcommon.to_int(256 * R)
+    G = yuvcommon.to_int(256 * G)
+    B = yuvcommon.to_int(256 * B)
     return (yuvcommon.normalize(R), yuvcommon.normalize(G), yuvcommon.normalize(B))
 
 
@@ -155,9 +160,9 @@ def convert_rgb2yuv_ycbcr_hdtv_analog(R, G, B):
     Y = 0.213 * R + 0.715 * G + 0.072 * B  # NOQA: E201,E241,E221,E222
     Pb = -0.115 * R - 0.385 * G + 0.500 * B  # NOQA: E201,E241,E221,E222
     Pr = 0.500 * R - 0.454 * G - 0.046 * B  # NOQA: E201,E241,E221,E222
-    Y = int(256 * Y)  # NOQA: E201,E241,E221
-    Cb = int(256 * Pb + 128)
-    Cr = int(256 * Pr + 128)
+    Y = yuvcommon.to_int(256 * Y)  # NOQA: E201,E241,E221
+    Cb = yuvcommon.to_int(256 * Pb + 128)
+    Cr = yuvcommon.to_int(256 * Pr + 128)
     return Y, Cb, Cr
 
 
@@ -168,9 +173,9 @@ def convert_yuv2rgb_ycbcr_hdtv_analog(Y, U, V):
     G = Y - 0.468 * Pr - 0.187 * Pb
     B = Y + 1.856 * Pb  # NOQA: E221
     # convert back to integer
-    R = int(256 * R)
-    G = int(256 * G)
-    B = int(256 * B)
+    R = yuvcommon.to_int(256 * R)
+    G = yuvcommon.to_int(256 * G)
+    B = yuvcommon.to_int(256 * B)
     return (yuvcommon.normalize(R), yuvcommon.normalize(G), yuvcommon.normalize(B))
 
 
@@ -255,13 +260,45 @@ def h273_Clip1C(x, BitDepthC):
 
 
 def h273_Clip3(x, y, z):
+    if isinstance(z, np.ndarray):
+        return np.clip(z, x, y)
     return x if z < x else (y if z > y else z)  # Equation (4) fixed
 
 
 def h273_Round(x):
+    if isinstance(x, np.ndarray):
+        return np.copysign(np.floor(np.abs(x) + 0.5), x).astype(np.int64)
     return int(math.copysign(math.floor(abs(x) + 0.5), x))  # Equation (8)
 
 
+# matrix product of a (3x3 or 4x4) matrix and a vector of components.
+# Uses an explicit sum of products instead of numpy's matrix product, so
+# that it works the same for scalar components and for full planes, and
+# so that the floating-point summation order is fixed (even and odd
+# columns separately, then together) instead of depending on the BLAS
+# library numpy uses. This order reproduces the results of the original
+# `matrix @ vector` code on the platforms we tested.
+def h273_matmul(matrix, vector):
+    return [
+        sum(m * v for m, v in zip(row[0::2], vector[0::2]))
+        + sum(m * v for m, v in zip(row[1::2], vector[1::2]))
+        for row in matrix
+    ]
+
+
+# piecewise chroma scaling (Equations (61) to (64))
+def h273_scale_chroma(x, N, P):
+    if isinstance(x, np.ndarray):
+        if np.any((x < -N) | (x > P)):
+            raise AssertionError("invalid h273 chroma difference")
+        return np.where(x <= 0, x / (2 * N), x / (2 * P))
+    if -N <= x and x <= 0:
+        return x / (2 * N)
+    if 0 < x and x <= P:
+        return x / (2 * P)
+    raise AssertionError(f"invalid h273 chroma difference: {x}")
+
+
 # int->float conversion for Y and RGB
 # TODO(chemag): add bit_depth to support != 8 bits/component
 def h273_int_to_float_yrgb(x, color_range):
@@ -365,14 +402,8 @@ def convert_rgb2yuv_h273(R, G, B, mc, color_range_yuv, color_range_rgb):
         NR = 1 - Kr  # Equation (67)
         PR = 1 - (Kr)  # Equation (68)
         EY = Kr * ER + (1 - Kr - Kb) * EG + Kb * EB  # Equation (59)
-        if -NB <= (EB - EY) and (EB - EY) <= 0:
-            EPB = (EB - EY) / (2 * NB)  # Equation (61)
-        if 0 < EB - EY and EB - EY <= PB:
-            EPB = (EB - EY) / (2 * PB)  # Equation (62)
-        if -NR <= (ER - EY) and (ER - EY) <= 0:
-            EPR = (ER - EY) / (2 * NR)  # Equation (63)
-        if 0 < (ER - EY) and (ER - EY) <= PR:
-            EPR = (ER - EY) / (2 * PR)  # Equation (64)
+        EPB = h273_scale_chroma(EB - EY, NB, PB)  # Equations (61), (62)
+        EPR = h273_scale_chroma(ER - EY, NR, PR)  # Equations (63), (64)
     elif mc == 11:
         EY = EG  # Equation (69)
         EPB = (0.986566 * EB - EY) / 2.0  # Equation (70)
@@ -400,6 +431,25 @@ def convert_rgb2yuv_h273(R, G, B, mc, color_range_yuv, color_range_rgb):
     return (Y, Pb, Pr)
 
 
+# inverse of the generic (Equations (38) to (40)) 4x4 transfer matrix.
+# Matrices are built (and inverted) once per (Kr, Kb) pair (callers must
+# not modify them).
+@functools.lru_cache(maxsize=None)
+def h273_get_generic_matrix_yuv2rgb(Kr, Kb):
+    Kg = 1.0 - Kr - Kb
+    u_m = 0.5 / (1.0 - Kb)
+    v_m = 0.5 / (1.0 - Kr)
+    inv_matrix = np.array(
+        [
+            [Kr, Kg, Kb, 0.0],  # Y
+            [u_m * -Kr, u_m * -Kg, u_m * (1.0 - Kb), 0.5],  # U
+            [v_m * (1.0 - Kr), v_m * -Kg, v_m * -Kb, 0.5],  # V
+            [0.0, 0.0, 0.0, 1.0],
+        ]
+    )
+    return np.linalg.inv(inv_matrix)
+
+
 # Implementation of Rec. ITU-T H.273 (07/2021), Section 8.3 ("Matrix coefficients")
 def convert_yuv2rgb_h273(Y, U, V, mc, color_range_yuv, color_range_rgb):
     BitDepthY = 8
@@ -418,19 +468,8 @@ def convert_yuv2rgb_h273(Y, U, V, mc, color_range_yuv, color_range_rgb):
         elif mc in (12, 13):
             raise AssertionError(f"unsupported h273 mc: {mc}")
     if mc not in (0, 8, 10, 11, 13, 14):
-        Kg = 1.0 - Kr - Kb
-        u_m = 0.5 / (1.0 - Kb)
-        v_m = 0.5 / (1.0 - Kr)
-        inv_matrix = np.array(
-            [
-                [Kr, Kg, Kb, 0.0],  # Y
-                [u_m * -Kr, u_m * -Kg, u_m * (1.0 - Kb), 0.5],  # U
-                [v_m * (1.0 - Kr), v_m * -Kg, v_m * -Kb, 0.5],  # V
-                [0.0, 0.0, 0.0, 1.0],
-            ]
-        )
-        matrix = np.linalg.inv(inv_matrix)
-        (ER, EG, EB, _) = matrix @ (EY, EU, EV, 1)
+        matrix = h273_get_generic_matrix_yuv2rgb(Kr, Kb)
+        (ER, EG, EB, _) = h273_matmul(matrix, (EY, EU, EV, 1))
     elif mc == 0:
         Y, Cb, Cr = Y, U, V
         G = h273_Round(Y)  # Equation (41)
@@ -485,7 +524,7 @@ def convert_yuv2rgb_h273(Y, U, V, mc, color_range_yuv, color_range_rgb):
                     [1.0, 1.88140000e00, 2.38961873e-17],
                 ]
             )
-            ER, EG, EB = matrix @ (EY, EPB, EPR)
+            ER, EG, EB = h273_matmul(matrix, (EY, EPB, EPR))
         elif mc == 13:
             raise AssertionError(f"unsupported mc: {mc}")
     elif mc == 11:
@@ -499,7 +538,7 @@ def convert_yuv2rgb_h273(Y, U, V, mc, color_range_yuv, color_range_rgb):
                 [1.01361693, 2.02723386, 0.0],
             ]
         )
-        ER, EG, EB = matrix @ (EY, EPB, EPR)
+        ER, EG, EB = h273_matmul(matrix, (EY, EPB, EPR))
     elif mc == 14:
         EY, EPB, EPR = EY, EU - 0.5, EV - 0.5
         # m = np.array([[0.5, 0.5, 0.0], [6610/4096, -7465/4096, 3840/4096], [9500/4096, - 9212/4096, - 288/4096]])
@@ -511,7 +550,7 @@ def convert_yuv2rgb_h273(Y, U, V, mc, color_range_yuv, color_range_rgb):
                 [0.26416774, 1.00970484, -0.759491],
             ]
         )
-        EL, EM, ES = matrix @ (EY, EPB, EPR)
+        EL, EM, ES = h273_matmul(matrix, (EY, EPB, EPR))
         # m = np.array([[1688, 2146, 262], [683, 2951, 462], [99, 309, 3688]])
         # np.linalg.inv(m)
         matrix = np.array(
@@ -521,7 +560,7 @@ def convert_yuv2rgb_h273(Y, U, V, mc, color_range_yuv, color_range_rgb):
                 [-6.33542473e-06, -2.41488561e-05, 2.74624906e-04],
             ]
         )
-        (ER, EG, EB) = 4096 * matrix @ (EL, EM, ES)
+        (ER, EG, EB) = h273_matmul(4096 * matrix, (EL, EM, ES))
 
     # 3. normalize R, G, B to the color range
     R = h273_Clip1Y(
@@ -548,7 +587,7 @@ def convert_rgb2yuv_h273_chromium(R, G, B, mc, color_range_yuv, color_range_rgb)
     # 2. calculate the transfer matrix
     matrix_rgb2yuv = h273_get_transfer_matrix_rgb2yuv(mc)
     # 3. use matrix product to get the output components
-    EY, EU, EV, _ = matrix_rgb2yuv @ np.array([ER, EG, EB, 1])
+    EY, EU, EV, _ = h273_matmul(matrix_rgb2yuv, (ER, EG, EB, 1))
     # 4. normalize Y, U, V to the color range
     Y = h273_Clip1Y(
         h273_float_to_int_yrgb(EY, color_range_yuv), BitDepthY
@@ -573,7 +612,7 @@ def convert_yuv2rgb_h273_chromium(Y, U, V, mc, color_range_yuv, color_range_rgb)
     # 2. calculate the transfer matrix
     matrix_yuv2rgb = h273_get_transfer_matrix_yuv2rgb(mc)
     # 3. use matrix product to get the output components
-    ER, EG, EB, _ = matrix_yuv2rgb @ np.array([EY, EU, EV, 1])
+    ER, EG, EB, _ = h273_matmul(matrix_yuv2rgb, (EY, EU, EV, 1))
     # 4. normalize R, G, B to the color range
     R = h273_Clip1Y(
         h273_float_to_int_yrgb(ER, color_range_rgb), BitDepthY
@@ -592,6 +631,8 @@ def convert_yuv2rgb_h273_chromium(Y, U, V, mc, color_range_yuv, color_range_rgb)
 # Implementation from ColorSpace::GetTransferMatrix in
 # chromium/src/ui/gfx/color_space.cc
 # https://chromium.googlesource.com/chromium/src/+/refs/heads/main/ui/gfx/color_space.cc#1009
+# Matrices are built once per mc (callers must not modify them).
+@functools.lru_cache(maxsize=None)
 def h273_get_transfer_matrix_rgb2yuv(mc):
     assert mc in (0, 1, 4, 5, 6, 7, 8, 9, 10, 11), f"error: unsupported mc: {mc}"
     BitDepthY = 8
@@ -678,13 +719,63 @@ def h273_get_transfer_matrix_rgb2yuv(mc):
     )
 
 
-# Matrix is (Y, U, V) -> (R, G, B).
+# Matrix is (Y, U, V) -> (R, G, B). Matrices are inverted once per mc.
+@functools.lru_cache(maxsize=None)
 def h273_get_transfer_matrix_yuv2rgb(mc):
     matrix = h273_get_transfer_matrix_rgb2yuv(mc)
     # return the inverse of the matrix
     return np.linalg.inv(matrix)
 
 
+class ConversionPlan:
+    """An h273/h273chromium conversion with its parameters bound.
+
+    The plan runs the step-by-step conversion function (normalization,
+    matrix product, and rounding), so its results are bit-exact with it.
+    The per-mc transfer matrices (and their inverses) are cached, so running
+    a plan does not re-derive (nor invert) them for every pixel.
+
+    Plans work on both scalars and numpy arrays (full planes).
+    """
+
+    def __init__(self, conversion_function, mc, color_range_yuv, color_range_rgb):
+        self.conversion_function = conversion_function
+        self.mc = mc
+        self.color_range_yuv = color_range_yuv
+        self.color_range_rgb = color_range_rgb
+
+    def __repr__(self):
+        return "ConversionPlan(%s, mc=%r, color_range_yuv=%r, color_range_rgb=%r)" % (
+            self.conversion_function.__name__,
+            self.mc,
+            self.color_range_yuv,
+            self.color_range_rgb,
+        )
+
+    def __call__(self, a, b, c):
+        return self.conversion_function(
+            a, b, c, self.mc, self.color_range_yuv, self.color_range_rgb
+        )
+
+
+# get the ConversionPlan for an h273/h273chromium conversion. Plans are
+# built once per set of parameters.
+@functools.lru_cache(maxsize=None)
+def get_conversion_plan(
+    conversion_type, conversion_direction, mc, color_range_yuv, color_range_rgb
+):
+    if conversion_type not in ("h273", "h273chromium"):
+        raise AssertionError(f"no conversion plan for {conversion_type}")
+    if conversion_direction not in ("rgb2yuv", "yuv2rgb"):
+        raise AssertionError(f"no conversion plan for {conversion_direction}")
+    return ConversionPlan(
+        CONVERSION_FUNCTIONS[conversion_type][conversion_direction],
+        mc,
+        color_range_yuv,
+        color_range_rgb,
+    )
+
+
 CONVERSION_DIRECTIONS = (
     "yuv2yuv",
     "yuv2rgb",
@@ -755,6 +846,13 @@ CONVERSION_FUNCTIONS = {
 # per-component range of the matrix output
 default_values = {
     "func": "image",
+    "engine": "vector",
+    "lut_dir": os.path.join("~", ".cache", "yuvtools"),
+    "lut_cache_size": 1024,
+    "frames": None,
+    "chroma_siting": "last",
+    "chroma_upsample": "nearest",
+    "jobs": 1,
     "pixel": None,
     "width": 1280,
     "height": 720,
@@ -781,8 +879,6 @@ def convert_pixel_wrapper(options):
         ipix_fmt = "yuv444p"
         opix_fmt = "rgb24"
     elif options.conversion_direction == "rgb2yuv":
-        # add the alpha channel
-        idata.append(255)
         ipix_fmt = "rgb24"
         opix_fmt = "yuv444p"
     # convert the input pixel
@@ -797,11 +893,60 @@ def convert_pixel_wrapper(options):
         options.color_range_yuv,
         options.color_range_rgb,
         opix_fmt,
+        options.engine,
+        options.lut_dir,
+        options.chroma_siting,
+        options.chroma_upsample,
+        options.lut_cache_size,
     )
     # print the output pixel
     print(",".join(str(i) for i in list(odata)))
 
 
+# calculate the conversion direction from the input and output pixel formats
+def get_conversion_direction(ipix_fmt, opix_fmt):
+    if yuvcommon.is_yuv(ipix_fmt) and yuvcommon.is_yuv(opix_fmt):
+        return "yuv2yuv"
+    elif yuvcommon.is_yuv(ipix_fmt) and not yuvcommon.is_yuv(opix_fmt):
+        return "yuv2rgb"
+    elif not yuvcommon.is_yuv(ipix_fmt) and yuvcommon.is_yuv(opix_fmt):
+        return "rgb2yuv"
+    elif not yuvcommon.is_yuv(ipix_fmt) and not yuvcommon.is_yuv(opix_fmt):
+        return "rgb2rgb"
+
+
+# get the per-pixel conversion function, as a function of 3 components.
+# h273 conversions are returned as ConversionPlan objects.
+def get_conversion_function(
+    ipix_fmt,
+    opix_fmt,
+    conversion_direction=None,
+    conversion_type=None,
+    matrix_coefficients=None,
+    color_range_yuv=None,
+    color_range_rgb=None,
+):
+    # calculate the conversion direction
+    if conversion_direction is None:
+        conversion_direction = get_conversion_direction(ipix_fmt, opix_fmt)
+
+    if conversion_type is None:
+        conversion_type = default_values[conversion_direction]
+    if conversion_type in ("h273", "h273chromium"):
+        conversion_function = get_conversion_plan(
+            conversion_type,
+            conversion_direction,
+            matrix_coefficients,
+            color_range_yuv,
+            color_range_rgb,
+        )
+    else:
+        conversion_function = CONVERSION_FUNCTIONS[conversion_type][
+            conversion_direction
+        ]
+    return conversion_direction, conversion_type, conversion_function
+
+
 def convert_image(
     idata,
     w,
@@ -813,74 +958,572 @@ def convert_image(
     color_range_yuv,
     color_range_rgb,
     opix_fmt,
+    engine=None,
+    lut_dir=None,
+    chroma_siting=None,
+    chroma_upsample=None,
+    lut_cache_size=None,
+):
+    if engine is None:
+        engine = default_values["engine"]
+    if chroma_siting is None:
+        chroma_siting = default_values["chroma_siting"]
+    if chroma_upsample is None:
+        chroma_upsample = default_values["chroma_upsample"]
+    if (
+        engine in ("vector", "lut")
+        and is_vector_supported(w, h, ipix_fmt, opix_fmt)
+        and is_repack(ipix_fmt, opix_fmt, conversion_direction, conversion_type)
+    ):
+        convert_image_function = functools.partial(
+            convert_image_repack,
+            chroma_siting=chroma_siting,
+            chroma_upsample=chroma_upsample,
+        )
+    elif engine == "lut" and is_vector_supported(w, h, ipix_fmt, opix_fmt):
+        convert_image_function = functools.partial(
+            convert_image_lut,
+            lut_dir=lut_dir,
+            lut_cache_size=lut_cache_size,
+            chroma_siting=chroma_siting,
+            chroma_upsample=chroma_upsample,
+        )
+    elif engine == "vector" and is_vector_supported(w, h, ipix_fmt, opix_fmt):
+        convert_image_function = functools.partial(
+            convert_image_vector,
+            chroma_siting=chroma_siting,
+            chroma_upsample=chroma_upsample,
+        )
+    else:
+        # the scalar engine writes the last pixel of each chroma block
+        if chroma_siting != "last" and yuvcommon.get_chroma_subsampling(
+            opix_fmt
+        ) != (1, 1):
+            print(
+                "error: chroma siting %s requires the vector or lut engine "
+                "(and a frame size multiple of the chroma subsampling)"
+                % chroma_siting
+            )
+            sys.exit(-1)
+        # the scalar engine reads the nearest chroma sample
+        if chroma_upsample != "nearest" and yuvcommon.get_chroma_subsampling(
+            ipix_fmt
+        ) != (1, 1):
+            print(
+                "error: chroma upsample %s requires the vector or lut engine "
+                "(and a frame size multiple of the chroma subsampling)"
+                % chroma_upsample
+            )
+            sys.exit(-1)
+        convert_image_function = convert_image_scalar
+    return convert_image_function(
+        idata,
+        w,
+        h,
+        ipix_fmt,
+        conversion_direction,
+        conversion_type,
+        matrix_coefficients,
+        color_range_yuv,
+        color_range_rgb,
+        opix_fmt,
+    )
+
+
+# reference engine: converts the image one pixel at a time
+def convert_image_scalar(
+    idata,
+    w,
+    h,
+    ipix_fmt,
+    conversion_direction,
+    conversion_type,
+    matrix_coefficients,
+    color_range_yuv,
+    color_range_rgb,
+    opix_fmt,
 ):
+    # use python ints for the input (numpy uint8 arithmetic wraps around)
+    if isinstance(idata, np.ndarray):
+        idata = array("B", idata.tobytes())
     # allocate output array
     odata = array("B")
     oframe_size = int(w * h * yuvcommon.get_length_factor(opix_fmt))
     odata.extend([255] * oframe_size)
 
-    # calculate the conversion direction
-    if conversion_direction is None:
-        if yuvcommon.is_yuv(ipix_fmt) and yuvcommon.is_yuv(opix_fmt):
-            conversion_direction = "yuv2yuv"
-        elif yuvcommon.is_yuv(ipix_fmt) and not yuvcommon.is_yuv(opix_fmt):
-            conversion_direction = "yuv2rgb"
-        elif not yuvcommon.is_yuv(ipix_fmt) and yuvcommon.is_yuv(opix_fmt):
-            conversion_direction = "rgb2yuv"
-        elif not yuvcommon.is_yuv(ipix_fmt) and not yuvcommon.is_yuv(opix_fmt):
-            conversion_direction = "rgb2rgb"
-
-    if conversion_type is None:
-        conversion_type = default_values[conversion_direction]
-    conversion_function = CONVERSION_FUNCTIONS[conversion_type][conversion_direction]
+    conversion_direction, conversion_type, conversion_function = (
+        get_conversion_function(
+            ipix_fmt,
+            opix_fmt,
+            conversion_direction,
+            conversion_type,
+            matrix_coefficients,
+            color_range_yuv,
+            color_range_rgb,
+        )
+    )
 
     # convert arrays
     for j in range(0, h):
         for i in range(0, w):
-            # get input components
-            a, b, c = yuvcommon.get_component_locations(i, j, w, h, ipix_fmt)
+            # get input components (missing components use a fixed value)
+            a, b, c = (
+                yuvcommon.MISSING_COMPONENT_VALUE if location is None else idata[location]
+                for location in yuvcommon.get_component_locations(
+                    i, j, w, h, ipix_fmt
+                )
+            )
             # get output components
             d, e, f = yuvcommon.get_component_locations(i, j, w, h, opix_fmt)
             # color conversion
-            if conversion_type in ("h273", "h273chromium"):
-                x, y, z = conversion_function(
-                    idata[a],
-                    idata[b],
-                    idata[c],
-                    matrix_coefficients,
-                    color_range_yuv,
-                    color_range_rgb,
-                )
-            else:
-                x, y, z = conversion_function(idata[a], idata[b], idata[c])
-            try:
-                odata[d], odata[e], odata[f] = int(x), int(y), int(z)
-            except OverflowError:
+            x, y, z = conversion_function(a, b, c)
+            x, y, z = int(x), int(y), int(z)
+            if not (0 <= x <= 255 and 0 <= y <= 255 and 0 <= z <= 255):
                 print(
-                    "error: overflow %s(%i, %i, %i)"
-                    % (conversion_function, idata[a], idata[b], idata[c])
+                    "error: overflow %s(%i, %i, %i)" % (conversion_function, a, b, c)
                 )
                 sys.exit(-1)
+            for location, value in zip((d, e, f), (x, y, z)):
+                # missing output components are dropped
+                if location is not None:
+                    odata[location] = value
 
     return odata
 
 
-def convert_image_wrapper(options):
-    # open input file
-    if options.infile == "-":
-        options.infile = "/dev/fd/0"
-    if options.outfile == "-":
-        options.outfile = "/dev/fd/1"
-    # read input array
-    idata = yuvcommon.read_image(
-        options.infile,
-        options.width,
-        options.height,
-        options.ipix_fmt,
-        options.frame_number,
+# the vector engine requires the chroma subsampling to divide the image size
+def is_vector_supported(w, h, ipix_fmt, opix_fmt):
+    for pix_fmt in (ipix_fmt, opix_fmt):
+        sx, sy = yuvcommon.get_chroma_subsampling(pix_fmt)
+        if w % sx != 0 or h % sy != 0:
+            return False
+    return True
+
+
+# chroma sitings: whether the chroma samples are co-sited with the luma
+# samples (vertical, horizontal), or located between 2 luma samples. The
+# legacy "last" siting is considered centered for interpolation
+CHROMA_SITING_COSITED = {
+    "last": (False, False),
+    # MPEG-2, H.264, HEVC default (4:2:0 type 0)
+    "left": (False, True),
+    # MPEG-1, JPEG (4:2:0 type 1)
+    "center": (False, False),
+    # 4:2:0 type 2 (e.g. BT.2020)
+    "topleft": (True, True),
+}
+
+# chroma upsampling kernels, as a list of (tap offset, weight) pairs,
+# where the weight is a function of the fractional position t
+CHROMA_UPSAMPLE_KERNELS = {
+    "bilinear": (
+        (0, lambda t: 1 - t),
+        (1, lambda t: t),
+    ),
+    "catmullrom": (
+        (-1, lambda t: (-(t**3) + 2 * t**2 - t) / 2),
+        (0, lambda t: (3 * t**3 - 5 * t**2 + 2) / 2),
+        (1, lambda t: (-3 * t**3 + 4 * t**2 + t) / 2),
+        (2, lambda t: (t**3 - t**2) / 2),
+    ),
+}
+
+
+# get the taps used to upsample `size` chroma samples by `factor`, as a
+# list of (chroma sample indices, weights) pairs, one per kernel tap. The
+# edges are replicated. Tables only depend on the geometry, so they are
+# built once per (size, factor, cosited, chroma_upsample)
+@functools.lru_cache(maxsize=16)
+def get_upsample_taps(size, factor, cosited, chroma_upsample):
+    # chroma coordinates of the luma samples
+    phase = 0 if cosited else (factor - 1) / 2
+    position = (np.arange(size * factor) - phase) / factor
+    base = np.floor(position).astype(np.int64)
+    t = position - base
+    return [
+        (np.clip(base + offset, 0, size - 1), weight(t))
+        for offset, weight in CHROMA_UPSAMPLE_KERNELS[chroma_upsample]
+    ]
+
+
+# upsample a chroma plane by `factor` along an axis, interpolating at the
+# luma sample positions
+def upsample_chroma_axis(plane, axis, factor, cosited, chroma_upsample):
+    shape = [1, 1]
+    shape[axis] = -1
+    out = 0
+    for indices, weights in get_upsample_taps(
+        plane.shape[axis], factor, cosited, chroma_upsample
+    ):
+        taps = np.take(plane, indices, axis=axis)
+        out = out + taps * weights.reshape(shape)
+    return out
+
+
+# upsample a chroma plane to the full image size. "nearest" repeats each
+# chroma sample (the scalar engine behavior)
+def upsample_chroma(plane, sx, sy, chroma_upsample, chroma_siting):
+    if chroma_upsample == "nearest":
+        return plane.repeat(sy, axis=0).repeat(sx, axis=1)
+    plane = plane.astype(np.float64)
+    for axis, (factor, cosited) in enumerate(
+        zip((sy, sx), CHROMA_SITING_COSITED[chroma_siting])
+    ):
+        if factor > 1:
+            plane = upsample_chroma_axis(plane, axis, factor, cosited, chroma_upsample)
+    return np.clip(np.floor(plane + 0.5), 0, 255).astype(np.uint8)
+
+
+# chroma upsampling stage: returns the uint8 planes of a frame, upsampled
+# to the full image size
+def get_upsampled_planes(frame, w, h, pix_fmt, chroma_upsample, chroma_siting):
+    sx, sy = yuvcommon.get_chroma_subsampling(pix_fmt)
+    planes = []
+    for plane_id, plane in enumerate(yuvcommon.get_planes(frame, w, h, pix_fmt)):
+        if plane_id > 0 and (sx, sy) != (1, 1):
+            plane = upsample_chroma(plane, sx, sy, chroma_upsample, chroma_siting)
+        planes.append(plane)
+    return planes
+
+
+# returns the input planes, upsampled to the full image size, and promoted
+# to python-like (unbounded) integer arithmetic
+def get_input_planes(
+    idata, w, h, ipix_fmt, chroma_upsample="nearest", chroma_siting="last"
+):
+    iframe_size = int(w * h * yuvcommon.get_length_factor(ipix_fmt))
+    iframe = np.asarray(idata, dtype=np.uint8)[:iframe_size]
+    iplanes = get_upsampled_planes(
+        iframe, w, h, ipix_fmt, chroma_upsample, chroma_siting
     )
-    # generate gradient file
-    odata = convert_image(
+    return [plane.astype(np.int64) for plane in iplanes]
+
+
+# converts full-size input planes into full-size output planes. Returns
+# the output planes and a mask with the pixels that overflow
+def convert_planes(conversion_function, a, b, c):
+    x, y, z = conversion_function(a, b, c)
+    oplanes = [
+        np.broadcast_to(yuvcommon.to_int(np.asarray(v)), a.shape) for v in (x, y, z)
+    ]
+    invalid = np.zeros(a.shape, dtype=bool)
+    for plane in oplanes:
+        invalid |= (plane < 0) | (plane > 255)
+    return oplanes, invalid
+
+
+# reports an overflow using the first invalid pixel
+def check_overflow(invalid, conversion_function, a, b, c):
+    if invalid.any():
+        j, i = np.unravel_index(np.argmax(invalid), invalid.shape)
+        print(
+            "error: overflow %s(%i, %i, %i)"
+            % (conversion_function, a[j, i], b[j, i], c[j, i])
+        )
+        sys.exit(-1)
+
+
+# 2-tap (box) filter along an axis: averages each pair of samples
+def chroma_filter_box(plane, axis):
+    plane = np.moveaxis(plane, axis, 0)
+    return np.moveaxis(plane[0::2] + plane[1::2], 0, axis), 2
+
+
+# 3-tap [1, 2, 1] filter along an axis, centered on the even samples (the
+# edges are replicated)
+def chroma_filter_cosited(plane, axis):
+    plane = np.moveaxis(plane, axis, 0)
+    prev = np.concatenate((plane[:1], plane[1:-1:2]))
+    return np.moveaxis(prev + 2 * plane[0::2] + plane[1::2], 0, axis), 4
+
+
+# subsample a full-size chroma plane. "last" uses the last pixel of each
+# block (no filtering), like the scalar engine. The other chroma sitings
+# filter the full-size plane, and produce each chroma sample once: chroma
+# samples co-sited with a luma sample use a [1, 2, 1] filter centered on
+# that luma sample, and chroma samples located between 2 luma samples use
+# their average.
+def downsample_chroma(plane, sx, sy, chroma_siting):
+    if chroma_siting == "last":
+        return plane[sy - 1 :: sy, sx - 1 :: sx]
+    plane = plane.astype(np.int64)
+    weight = 1
+    for axis, (factor, cosited) in enumerate(
+        zip((sy, sx), CHROMA_SITING_COSITED[chroma_siting])
+    ):
+        if factor == 2:
+            chroma_filter = chroma_filter_cosited if cosited else chroma_filter_box
+            plane, filter_weight = chroma_filter(plane, axis)
+            weight *= filter_weight
+    return (plane + weight // 2) // weight
+
+
+# returns the output frame, with the full-size output planes subsampled
+# to the output chroma size
+def get_output_frame(oplanes, w, h, opix_fmt, chroma_siting="last"):
+    oframe_size = int(w * h * yuvcommon.get_length_factor(opix_fmt))
+    oframe = np.full(oframe_size, 255, dtype=np.uint8)
+    sx, sy = yuvcommon.get_chroma_subsampling(opix_fmt)
+    for plane_id, (oview, plane) in enumerate(
+        zip(yuvcommon.get_planes(oframe, w, h, opix_fmt), oplanes)
+    ):
+        if plane_id > 0 and (sx, sy) != (1, 1):
+            plane = downsample_chroma(plane, sx, sy, chroma_siting)
+        oview[:] = plane
+    odata = array("B")
+    odata.frombytes(oframe)
+    return odata
+
+
+# vector engine: converts the full image planes using numpy array math.
+# Produces the same bytes than the scalar (reference) engine. In particular:
+# (1) subsampled input chroma is upsampled using nearest neighbour, and
+# (2) subsampled output chroma uses the last pixel of each block (the
+# scalar engine writes each chroma sample once per pixel in the block).
+def convert_image_vector(
+    idata,
+    w,
+    h,
+    ipix_fmt,
+    conversion_direction,
+    conversion_type,
+    matrix_coefficients,
+    color_range_yuv,
+    color_range_rgb,
+    opix_fmt,
+    chroma_siting="last",
+    chroma_upsample="nearest",
+):
+    conversion_direction, conversion_type, conversion_function = (
+        get_conversion_function(
+            ipix_fmt,
+            opix_fmt,
+            conversion_direction,
+            conversion_type,
+            matrix_coefficients,
+            color_range_yuv,
+            color_range_rgb,
+        )
+    )
+    a, b, c = get_input_planes(
+        idata, w, h, ipix_fmt, chroma_upsample, chroma_siting
+    )
+    oplanes, invalid = convert_planes(conversion_function, a, b, c)
+    check_overflow(invalid, conversion_function, a, b, c)
+    return get_output_frame(oplanes, w, h, opix_fmt, chroma_siting)
+
+
+# unit conversions only need to move (and resample) the planes
+def is_repack(ipix_fmt, opix_fmt, conversion_direction, conversion_type):
+    if conversion_type is None:
+        if conversion_direction is None:
+            conversion_direction = get_conversion_direction(ipix_fmt, opix_fmt)
+        conversion_type = default_values[conversion_direction]
+    return conversion_type == "unit"
+
+
+# repack engine: converts the pixel format of the image without color
+# math, by copying the input planes into the output planes (uint8 strided
+# copies). Chroma planes are only resampled when the input and output
+# chroma subsampling differ (using the vector engine chroma stages).
+def convert_image_repack(
+    idata,
+    w,
+    h,
+    ipix_fmt,
+    conversion_direction,
+    conversion_type,
+    matrix_coefficients,
+    color_range_yuv,
+    color_range_rgb,
+    opix_fmt,
+    chroma_siting="last",
+    chroma_upsample="nearest",
+):
+    iframe_size = int(w * h * yuvcommon.get_length_factor(ipix_fmt))
+    iframe = np.asarray(idata, dtype=np.uint8)[:iframe_size]
+    oframe_size = int(w * h * yuvcommon.get_length_factor(opix_fmt))
+    oframe = np.full(oframe_size, 255, dtype=np.uint8)
+    isx, isy = yuvcommon.get_chroma_subsampling(ipix_fmt)
+    osx, osy = yuvcommon.get_chroma_subsampling(opix_fmt)
+    if (isx, isy) not in ((osx, osy), (1, 1)) and chroma_upsample != "nearest":
+        # use the upsampling stage
+        iplanes = get_upsampled_planes(
+            iframe, w, h, ipix_fmt, chroma_upsample, chroma_siting
+        )
+        isx, isy = 1, 1
+    else:
+        iplanes = yuvcommon.get_planes(iframe, w, h, ipix_fmt)
+    for plane_id, (iplane, oview) in enumerate(
+        zip(iplanes, yuvcommon.get_planes(oframe, w, h, opix_fmt))
+    ):
+        if plane_id > 0 and (isx, isy) != (osx, osy):
+            if (isx, isy) != (1, 1):
+                iplane = upsample_chroma(iplane, isx, isy, "nearest", chroma_siting)
+            if (osx, osy) != (1, 1):
+                iplane = downsample_chroma(iplane, osx, osy, chroma_siting)
+        oview[:] = iplane
+    odata = array("B")
+    odata.frombytes(oframe)
+    return odata
+
+
+# the LUT file format version. Bump it every time a conversion function
+# changes its output, so that stale LUTs are not used
+LUT_VERSION = 2
+
+
+def get_conversion_lut_path(
+    lut_dir,
+    conversion_direction,
+    conversion_type,
+    matrix_coefficients,
+    color_range_yuv,
+    color_range_rgb,
+):
+    if conversion_type not in ("h273", "h273chromium"):
+        # only the h273 conversions are parametrized
+        matrix_coefficients = color_range_yuv = color_range_rgb = None
+    name = "lut.v%i.%s.%s.%s.%s.%s.npy" % (
+        LUT_VERSION,
+        conversion_type,
+        conversion_direction,
+        matrix_coefficients,
+        color_range_yuv,
+        color_range_rgb,
+    )
+    return os.path.join(os.path.expanduser(lut_dir), name)
+
+
+# exhaustive 3D LUT: the result of running a conversion function on each
+# of the 2^24 possible (a, b, c) inputs. The LUT is a (2^24, 4) uint8
+# array indexed by `(a << 16) | (b << 8) | c`, where the first 3 columns
+# are the (clipped) output components, and the last column is 1 if the
+# conversion overflows for that input, and 0 otherwise. LUTs are cached
+# in `lut_dir` (when writable), and mmap'ed from there. The LUT cache is
+# kept under `lut_cache_size` MB by evicting the least-recently used LUTs.
+@functools.lru_cache(maxsize=4)
+def get_conversion_lut(
+    lut_dir,
+    lut_cache_size,
+    conversion_direction,
+    conversion_type,
+    matrix_coefficients,
+    color_range_yuv,
+    color_range_rgb,
+):
+    lut_path = get_conversion_lut_path(
+        lut_dir,
+        conversion_direction,
+        conversion_type,
+        matrix_coefficients,
+        color_range_yuv,
+        color_range_rgb,
+    )
+    if os.path.exists(lut_path):
+        # mark it as recently used
+        try:
+            os.utime(lut_path)
+        except OSError:
+            pass
+        return np.load(lut_path, mmap_mode="r")
+
+    if conversion_type in ("h273", "h273chromium"):
+        conversion_function = get_conversion_plan(
+            conversion_type,
+            conversion_direction,
+            matrix_coefficients,
+            color_range_yuv,
+            color_range_rgb,
+        )
+    else:
+        conversion_function = CONVERSION_FUNCTIONS[conversion_type][
+            conversion_direction
+        ]
+
+    # build the LUT using the vector engine, one a-value at a time
+    lut = np.empty((256, 256 * 256, 4), dtype=np.uint8)
+    b, c = np.meshgrid(np.arange(256), np.arange(256), indexing="ij")
+    for a in range(256):
+        oplanes, invalid = convert_planes(
+            conversion_function, np.full(b.shape, a, dtype=np.int64), b, c
+        )
+        for plane_id, plane in enumerate(oplanes):
+            lut[a, :, plane_id] = np.clip(plane, 0, 255).reshape(-1)
+        lut[a, :, 3] = invalid.reshape(-1)
+    lut = lut.reshape(-1, 4)
+
+    # store it atomically (an unwritable cache dir is not an error), unless
+    # it is larger than the cache
+    max_size = lut_cache_size * 1024 * 1024
+    if lut.nbytes > max_size:
+        return lut
+    try:
+        os.makedirs(os.path.dirname(lut_path), exist_ok=True)
+        with yuvcommon.atomic_write(lut_path) as fout:
+            np.save(fout, lut)
+        yuvcommon.evict_cache(
+            os.path.dirname(lut_path), max_size, "lut.v*.npy", lut_path
+        )
+    except OSError:
+        pass
+    return lut
+
+
+# lut engine: converts the full image planes using a gather from an
+# exhaustive 3D LUT. Produces the same bytes than the vector engine.
+def convert_image_lut(
+    idata,
+    w,
+    h,
+    ipix_fmt,
+    conversion_direction,
+    conversion_type,
+    matrix_coefficients,
+    color_range_yuv,
+    color_range_rgb,
+    opix_fmt,
+    lut_dir=None,
+    chroma_siting="last",
+    chroma_upsample="nearest",
+    lut_cache_size=None,
+):
+    if lut_dir is None:
+        lut_dir = default_values["lut_dir"]
+    if lut_cache_size is None:
+        lut_cache_size = default_values["lut_cache_size"]
+    conversion_direction, conversion_type, conversion_function = (
+        get_conversion_function(
+            ipix_fmt,
+            opix_fmt,
+            conversion_direction,
+            conversion_type,
+            matrix_coefficients,
+            color_range_yuv,
+            color_range_rgb,
+        )
+    )
+    lut = get_conversion_lut(
+        lut_dir,
+        lut_cache_size,
+        conversion_direction,
+        conversion_type,
+        matrix_coefficients,
+        color_range_yuv,
+        color_range_rgb,
+    )
+    a, b, c = get_input_planes(
+        idata, w, h, ipix_fmt, chroma_upsample, chroma_siting
+    )
+    values = lut[(a << 16) | (b << 8) | c]
+    check_overflow(values[..., 3] != 0, conversion_function, a, b, c)
+    oplanes = [values[..., plane_id] for plane_id in range(3)]
+    return get_output_frame(oplanes, w, h, opix_fmt, chroma_siting)
+
+
+# converts a frame using the CLI options
+def convert_frame(options, idata):
+    return convert_image(
         idata,
         options.width,
         options.height,
@@ -891,10 +1534,113 @@ def convert_image_wrapper(options):
         options.color_range_yuv,
         options.color_range_rgb,
         options.opix_fmt,
+        options.engine,
+        options.lut_dir,
+        options.chroma_siting,
+        options.chroma_upsample,
+        options.lut_cache_size,
     )
-    # write the output file
+
+
+# parallel conversion worker: converts the frames in the `frame_numbers`
+# range, and writes them in the output file, starting at output frame
+# `first_index` (frames are fixed size, so their offsets are known)
+def convert_frames_worker(options, first_index, frame_numbers):
+    oframe_size = int(
+        options.width * options.height * yuvcommon.get_length_factor(options.opix_fmt)
+    )
+    with open(options.outfile, "r+b") as fout:
+        fout.seek(first_index * oframe_size)
+        for idata in yuvcommon.map_frames(
+            options.infile,
+            options.width,
+            options.height,
+            options.ipix_fmt,
+            frame_numbers.start,
+            frame_numbers.stop,
+            frame_numbers.step,
+        ):
+            convert_frame(options, idata).tofile(fout)
+
+
+# parallel conversion: splits the frame range in contiguous chunks (a few
+# per worker, to balance the load), and converts them in a process pool
+def convert_frames_parallel(options, start, end, step):
+    iframe_size = int(
+        options.width * options.height * yuvcommon.get_length_factor(options.ipix_fmt)
+    )
+    oframe_size = int(
+        options.width * options.height * yuvcommon.get_length_factor(options.opix_fmt)
+    )
+    num_frames = os.path.getsize(options.infile) // iframe_size
+    end = num_frames if end is None else min(end, num_frames)
+    frame_numbers = range(start, end, step)
+    # allocate the output file
     with open(options.outfile, "wb") as fout:
-        odata.tofile(fout)
+        fout.truncate(len(frame_numbers) * oframe_size)
+    chunk_size = max(1, math.ceil(len(frame_numbers) / (4 * options.jobs)))
+    for _ in yuvcommon.run_in_pool(
+        options.jobs,
+        convert_frames_worker,
+        [
+            (
+                options,
+                first_index,
+                frame_numbers[first_index : first_index + chunk_size],
+            )
+            for first_index in range(0, len(frame_numbers), chunk_size)
+        ],
+    ):
+        pass
+
+
+# parallel conversion requires seekable input and output files ("-" means
+# stdin/stdout, even if a "-" file exists)
+def is_parallel_supported(options):
+    return (
+        options.jobs > 1
+        and options.frames is not None
+        and options.infile != "-"
+        and options.outfile != "-"
+        and os.path.isfile(options.infile)
+        and (not os.path.exists(options.outfile) or os.path.isfile(options.outfile))
+    )
+
+
+def convert_image_wrapper(options):
+    # get the frame range (default to a single frame)
+    if options.frames is None:
+        start, end, step = options.frame_number, options.frame_number + 1, 1
+    else:
+        start, end, step = yuvcommon.parse_frame_range(options.frames)
+    if is_parallel_supported(options):
+        convert_frames_parallel(options, start, end, step)
+        return
+    num_frames = 0
+    # regular files are memory-mapped, other inputs (e.g. pipes) are read.
+    # "-" is always stdin, even if a "-" file exists
+    read_frames = (
+        yuvcommon.map_frames
+        if options.infile != "-" and os.path.isfile(options.infile)
+        else yuvcommon.read_frames
+    )
+    with yuvcommon.open_file(options.outfile, "wb") as fout:
+        # stream the input frames (one frame in memory at a time)
+        for idata in read_frames(
+            options.infile,
+            options.width,
+            options.height,
+            options.ipix_fmt,
+            start,
+            end,
+            step,
+        ):
+            # append the output frame
+            convert_frame(options, idata).tofile(fout)
+            num_frames += 1
+    if options.frames is None and num_frames == 0:
+        print("error: cannot read frame %i from %s" % (start, options.infile))
+        sys.exit(-1)
 
 
 def get_options(argv):
@@ -937,6 +1683,57 @@ def get_options(argv):
         help="%s" % (" | ".join(FUNCTIONS)),
     )
 
+    parser.add_argument(
+        "--engine",
+        action="store",
+        type=str,
+        dest="engine",
+        default=default_values["engine"],
+        choices=ENGINES,
+        help="conversion engine: %s (default: %s)"
+        % (" | ".join(ENGINES), default_values["engine"]),
+    )
+    parser.add_argument(
+        "--chroma-siting",
+        action="store",
+        type=str,
+        dest="chroma_siting",
+        default=default_values["chroma_siting"],
+        choices=CHROMA_SITINGS,
+        help="chroma siting used to downsample the output chroma: %s "
+        "(default: %s)" % (" | ".join(CHROMA_SITINGS), default_values["chroma_siting"]),
+    )
+    parser.add_argument(
+        "--chroma-upsample",
+        action="store",
+        type=str,
+        dest="chroma_upsample",
+        default=default_values["chroma_upsample"],
+        choices=CHROMA_UPSAMPLES,
+        help="kernel used to upsample the input chroma: %s (default: %s)"
+        % (" | ".join(CHROMA_UPSAMPLES), default_values["chroma_upsample"]),
+    )
+    parser.add_argument(
+        "--lut-dir",
+        action="store",
+        type=str,
+        dest="lut_dir",
+        default=default_values["lut_dir"],
+        metavar="LUT_DIR",
+        help="directory used to cache the lut engine tables (default: %s)"
+        % default_values["lut_dir"],
+    )
+    parser.add_argument(
+        "--lut-cache-size",
+        action="store",
+        type=int,
+        dest="lut_cache_size",
+        default=default_values["lut_cache_size"],
+        metavar="LUT_CACHE_SIZE",
+        help="max lut engine table cache size, in MB (default: %i)"
+        % default_values["lut_cache_size"],
+    )
+
     class PixelAction(argparse.Action):
         def __call__(self, parser, namespace, values, option_string=None):
             namespace.pixel = [int(v) for v in values[0].split(",")]
@@ -1071,6 +1868,18 @@ def get_options(argv):
     parser.add_argument(
         "-n", "--frame_number", required=False, help="frame number", type=int, default=0
     )
+    parser.add_argument(
+        "--frames",
+        action="store",
+        type=str,
+        dest="frames",
+        default=default_values["frames"],
+        metavar="[all | START:END[:STEP]]",
+        help="convert a range of frames (overrides --frame_number)",
+    )
+    yuvcommon.add_jobs_argument(
+        parser, default_values["jobs"], "multi-frame conversion"
+    )
     parser.add_argument(
         "-i",
         "--infile",
@@ -1100,11 +1909,12 @@ def main(argv):
     # print results
     if options.debug > 0:
         print(options)
-    # get in/out files
-    if options.infile in (None, "-"):
-        options.infile = sys.stdin
-    if options.outfile in (None, "-"):
-        options.outfile = sys.stdout
+    # get in/out files ("-" means stdin/stdout)
+    if options.infile is None:
+        options.infile = "-"
+    if options.outfile is None:
+        options.outfile = "-"
+    options.jobs = yuvcommon.get_num_jobs(options.jobs)
     if options.function == "image":
         convert_image_wrapper(options)
     elif options.function == "pixel":
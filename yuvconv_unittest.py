@@ -6,8 +6,18 @@
 
 from array import array
 import binascii
+import contextlib
+import io
+import itertools
+import numpy as np
+import os
+import random
+import subprocess
+import sys
+import tempfile
 import unittest
 
+import yuvcommon
 import yuvconv
 
 
@@ -931,6 +941,13 @@ class ConvertImageTestCase(unittest.TestCase):
 
     def testImageList(self):
         """Test IMAGE_TEST_LIST"""
+        # keep the lut engine tables out of the user cache
+        with tempfile.TemporaryDirectory() as lut_dir:
+            for engine in yuvconv.ENGINES:
+                self.runImageList(engine, lut_dir)
+        yuvconv.get_conversion_lut.cache_clear()
+
+    def runImageList(self, engine, lut_dir):
         i = 0
         for (
             test_name,
@@ -944,7 +961,7 @@ class ConvertImageTestCase(unittest.TestCase):
             ocont,
         ) in IMAGE_TEST_LIST:
             print(
-                f"# {i:02}: running {test_name} ({conversion_type=}/{conversion_direction=}"
+                f"# {i:02}: running {test_name} ({conversion_type=}/{conversion_direction=}/{engine=}"
             )
             idata = array(
                 "B", binascii.unhexlify(icont.replace(" ", "").replace("\n", ""))
@@ -960,6 +977,8 @@ class ConvertImageTestCase(unittest.TestCase):
                 None,
                 None,
                 opix_fmt,
+                engine,
+                lut_dir,
             )
             self.dumpToFile(idata, f"/tmp/yuvconv.{i:02}.{ipix_fmt}")
             self.dumpToFile(odata, f"/tmp/yuvconv.{i:02}.{opix_fmt}")
@@ -969,10 +988,449 @@ class ConvertImageTestCase(unittest.TestCase):
             self.assertEqual(
                 expected_odata,
                 odata,
-                f"{test_name=}, {conversion_direction=}, {conversion_type=}",
+                f"{test_name=}, {conversion_direction=}, {conversion_type=}, {engine=}",
             )
             i += 1
 
+    def convertOrExit(self, *args):
+        # conversions may fail (e.g. overflow): compare the error message
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                return yuvconv.convert_image(*args)
+        except SystemExit:
+            return output.getvalue()
+
+    def testPixFmtLayout(self):
+        """Test that the plane views match the per-pixel component locations"""
+        width, height = 8, 4
+        for pix_fmt in yuvcommon.PIX_FMTS:
+            frame_size = int(width * height * yuvcommon.get_length_factor(pix_fmt))
+            frame = np.arange(frame_size, dtype=np.uint8)
+            planes = yuvcommon.get_planes(frame, width, height, pix_fmt)
+            for j, i in itertools.product(range(height), range(width)):
+                locations = yuvcommon.get_component_locations(
+                    i, j, width, height, pix_fmt
+                )
+                for plane, location in zip(planes, locations):
+                    if location is None:
+                        continue
+                    sx, sy = width // plane.shape[1], height // plane.shape[0]
+                    self.assertEqual(
+                        location, plane[j // sy, i // sx], f"{pix_fmt=}, {i=}, {j=}"
+                    )
+        # rgb24 is packed with a 3-byte stride
+        self.assertEqual(
+            (3, 4, 5), yuvcommon.get_component_locations(1, 0, 2, 1, "rgb24")
+        )
+
+    def testEngines(self):
+        """Test that the vector engine matches the scalar (reference) engine"""
+        width, height = 8, 4
+        rng = random.Random(0)
+        for conversion_type, directions in yuvconv.CONVERSION_FUNCTIONS.items():
+            for conversion_direction in directions:
+                # h273 conversions are tested with BT.709 (mc=1)
+                matrix_coefficients, color_range_yuv, color_range_rgb = (
+                    (1, "limited", "full")
+                    if conversion_type in ("h273", "h273chromium")
+                    else (None, None, None)
+                )
+                for ipix_fmt, opix_fmt in itertools.product(yuvcommon.PIX_FMTS, repeat=2):
+                    if conversion_direction != "%s2%s" % (
+                        "yuv" if yuvcommon.is_yuv(ipix_fmt) else "rgb",
+                        "yuv" if yuvcommon.is_yuv(opix_fmt) else "rgb",
+                    ):
+                        continue
+                    isize = int(
+                        width * height * yuvcommon.get_length_factor(ipix_fmt)
+                    )
+                    idata = array("B", [rng.randrange(256) for _ in range(isize)])
+                    args = (
+                        idata,
+                        width,
+                        height,
+                        ipix_fmt,
+                        conversion_direction,
+                        conversion_type,
+                        matrix_coefficients,
+                        color_range_yuv,
+                        color_range_rgb,
+                        opix_fmt,
+                    )
+                    self.assertEqual(
+                        self.convertOrExit(*args, "scalar"),
+                        self.convertOrExit(*args, "vector"),
+                        f"{conversion_type=}, {conversion_direction=}, {ipix_fmt=}, {opix_fmt=}",
+                    )
+
+
+    def testChromaSiting(self):
+        """Test the chroma siting filters for 4:2:0 output"""
+        width, height = 8, 4
+        rng = random.Random(0)
+        idata = array("B", [rng.randrange(256) for _ in range(width * height * 4)])
+        args = (idata, width, height, "rgba", None, None, None, None, None)
+        # get the full-resolution chroma
+        frame = np.frombuffer(yuvconv.convert_image(*args, "yuv444p"), np.uint8)
+        _, u444, v444 = yuvcommon.get_planes(frame, width, height, "yuv444p")
+        for chroma_siting, kernel in (
+            ("center", np.array([[1, 1], [1, 1]])),
+            ("left", np.array([[1, 2, 1], [1, 2, 1]])),
+            ("topleft", np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]])),
+        ):
+            # reference: direct 2D convolution with edge replication
+            kh, kw = kernel.shape
+            expected_planes = []
+            for plane in (u444, v444):
+                padded = np.pad(
+                    plane.astype(np.int64),
+                    (((kh - 1) // 2, 1), ((kw - 1) // 2, 1)),
+                    mode="edge",
+                )
+                expected = np.zeros((height // 2, width // 2), dtype=np.int64)
+                for j, i in itertools.product(range(height // 2), range(width // 2)):
+                    block = padded[2 * j : 2 * j + kh, 2 * i : 2 * i + kw]
+                    expected[j, i] = (
+                        (block * kernel).sum() + kernel.sum() // 2
+                    ) // kernel.sum()
+                expected_planes.append(expected)
+            frame = np.frombuffer(
+                yuvconv.convert_image(*args, "yuv420p", "vector", None, chroma_siting),
+                np.uint8,
+            )
+            _, u420, v420 = yuvcommon.get_planes(frame, width, height, "yuv420p")
+            np.testing.assert_array_equal(expected_planes[0], u420)
+            np.testing.assert_array_equal(expected_planes[1], v420)
+        # the scalar engine only supports the legacy chroma siting
+        with self.assertRaises(SystemExit), contextlib.redirect_stdout(io.StringIO()):
+            yuvconv.convert_image(*args, "yuv420p", "scalar", None, "center")
+
+    def testChromaUpsample(self):
+        """Test the chroma upsampling kernels for 4:2:0 input"""
+        width, height = 8, 4
+        rng = random.Random(0)
+        isize = int(width * height * yuvcommon.get_length_factor("yuv420p"))
+        idata = array("B", [rng.randrange(256) for _ in range(isize)])
+        iframe = np.frombuffer(idata, np.uint8)
+        _, u420, v420 = yuvcommon.get_planes(iframe, width, height, "yuv420p")
+        args = (idata, width, height, "yuv420p", None, None, None, None, None)
+        for chroma_upsample in ("bilinear", "catmullrom"):
+            yuvconv.get_upsample_taps.cache_clear()
+            # co-sited chroma samples are kept as-is
+            frame = np.frombuffer(
+                yuvconv.convert_image(
+                    *args, "yuv444p", "vector", None, "topleft", chroma_upsample
+                ),
+                np.uint8,
+            )
+            _, u444, v444 = yuvcommon.get_planes(frame, width, height, "yuv444p")
+            np.testing.assert_array_equal(u420, u444[0::2, 0::2])
+            np.testing.assert_array_equal(v420, v444[0::2, 0::2])
+            # bilinear interpolates the samples in between
+            if chroma_upsample == "bilinear":
+                np.testing.assert_array_equal(
+                    (u420[:, :-1].astype(int) + u420[:, 1:] + 1) // 2,
+                    u444[0::2, 1:-1:2],
+                )
+            # the chroma planes of a second conversion with the same
+            # geometry reuse the taps (one table per axis)
+            yuvconv.convert_image(
+                *args, "rgba", "vector", None, "topleft", chroma_upsample
+            )
+            self.assertEqual(2, yuvconv.get_upsample_taps.cache_info().misses)
+        # the scalar engine only supports nearest upsampling
+        with self.assertRaises(SystemExit), contextlib.redirect_stdout(io.StringIO()):
+            yuvconv.convert_image(*args, "rgba", "scalar", None, None, "bilinear")
+
+    def testRepack(self):
+        """Test the repack (unit conversion) engine"""
+        self.assertTrue(yuvconv.is_repack("yuv420p", "nv12", None, None))
+        self.assertTrue(yuvconv.is_repack("rgba", "rgb24", None, None))
+        self.assertFalse(yuvconv.is_repack("yuv420p", "rgba", None, None))
+        self.assertFalse(yuvconv.is_repack("nv12", "nv12", None, "sdtv.basic"))
+        # round trips between formats with the same chroma subsampling
+        width, height = 8, 4
+        rng = random.Random(0)
+        for pix_fmt_list in (
+            ("yuv420p", "nv12", "nv21", "yuv420p"),
+            ("yuv422p", "yuyv422", "uyvy422", "yuv422p"),
+            ("rgb24", "bgra", "rgba", "rgb24"),
+        ):
+            isize = int(width * height * yuvcommon.get_length_factor(pix_fmt_list[0]))
+            idata = array("B", [rng.randrange(256) for _ in range(isize)])
+            odata = idata
+            for ipix_fmt, opix_fmt in zip(pix_fmt_list[:-1], pix_fmt_list[1:]):
+                odata = yuvconv.convert_image(
+                    odata, width, height, ipix_fmt, None, None, None, None, None, opix_fmt
+                )
+            self.assertEqual(idata, odata, f"{pix_fmt_list=}")
+
+    def testLUTEngine(self):
+        """Test that the lut engine matches the vector engine"""
+        width, height = 8, 4
+        rng = random.Random(0)
+        # LUTs are large (64 MB): only test a few conversions
+        for conversion_type, conversion_direction, matrix_coefficients in (
+            ("ycocgr", "rgb2yuv", None),
+            ("sdtv.digital", "yuv2rgb", None),
+            ("h273chromium", "rgb2yuv", 8),
+        ):
+            ipix_fmt, opix_fmt = (
+                ("rgba", "yuv420p")
+                if conversion_direction == "rgb2yuv"
+                else ("yuv420p", "rgba")
+            )
+            isize = int(width * height * yuvcommon.get_length_factor(ipix_fmt))
+            idata = array("B", [rng.randrange(256) for _ in range(isize)])
+            args = (
+                idata,
+                width,
+                height,
+                ipix_fmt,
+                conversion_direction,
+                conversion_type,
+                matrix_coefficients,
+                "limited",
+                "full",
+                opix_fmt,
+            )
+            expected = self.convertOrExit(*args, "vector")
+            with tempfile.TemporaryDirectory() as lut_dir:
+                # first run builds the LUT, second run loads it from disk
+                for _ in range(2):
+                    yuvconv.get_conversion_lut.cache_clear()
+                    self.assertEqual(
+                        expected,
+                        self.convertOrExit(*args, "lut", lut_dir),
+                        f"{conversion_type=}, {conversion_direction=}",
+                    )
+                self.assertEqual(1, len(os.listdir(lut_dir)))
+            yuvconv.get_conversion_lut.cache_clear()
+
+    def testLUTCacheSize(self):
+        """Test that the lut engine cache evicts the least-recently used LUTs"""
+        width, height = 8, 4
+        idata = array("B", [128] * (width * height * 4))
+        with tempfile.TemporaryDirectory() as lut_dir:
+            # the cache (100 MB) only fits 1 LUT (64 MB)
+            for conversion_type in ("sdtv.analog", "sdtv.digital"):
+                yuvconv.convert_image(
+                    idata,
+                    width,
+                    height,
+                    "rgba",
+                    "rgb2yuv",
+                    conversion_type,
+                    None,
+                    None,
+                    None,
+                    "yuv444p",
+                    "lut",
+                    lut_dir,
+                    lut_cache_size=100,
+                )
+            lut_name = "lut.v%i.sdtv.digital.rgb2yuv.None.None.None.npy" % (
+                yuvconv.LUT_VERSION
+            )
+            self.assertEqual([lut_name], os.listdir(lut_dir))
+        yuvconv.get_conversion_lut.cache_clear()
+
+
+    def testReadFrames(self):
+        """Test multi-frame streaming"""
+        width, height, pix_fmt = 4, 2, "yuv420p"
+        frame_size = int(width * height * yuvcommon.get_length_factor(pix_fmt))
+        # 5 frames, plus a trailing partial frame
+        frames = [bytes([i]) * frame_size for i in range(5)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            with open(infile, "wb") as fout:
+                fout.write(b"".join(frames) + b"\x05")
+            for frame_range, expected in (
+                ("all", [0, 1, 2, 3, 4]),
+                ("1:4", [1, 2, 3]),
+                ("1::2", [1, 3]),
+                (":2", [0, 1]),
+                ("3:10:3", [3]),
+                ("6:", []),
+            ):
+                start, end, step = yuvcommon.parse_frame_range(frame_range)
+                for read_frames in (yuvcommon.read_frames, yuvcommon.map_frames):
+                    self.assertEqual(
+                        [frames[i] for i in expected],
+                        [
+                            data.tobytes()
+                            for data in read_frames(
+                                infile, width, height, pix_fmt, start, end, step
+                            )
+                        ],
+                        f"{frame_range=}, {read_frames=}",
+                    )
+            # memory-mapped frames are valid conversion inputs
+            idata = yuvcommon.map_image(infile, width, height, pix_fmt, 3)
+            for engine in yuvconv.ENGINES[:2]:
+                self.assertEqual(
+                    yuvconv.convert_image(
+                        yuvcommon.read_image(infile, width, height, pix_fmt, 3),
+                        width,
+                        height,
+                        pix_fmt,
+                        None,
+                        None,
+                        None,
+                        None,
+                        None,
+                        "rgba",
+                        engine,
+                    ),
+                    yuvconv.convert_image(
+                        idata,
+                        width,
+                        height,
+                        pix_fmt,
+                        None,
+                        None,
+                        None,
+                        None,
+                        None,
+                        "rgba",
+                        engine,
+                    ),
+                    f"{engine=}",
+                )
+
+
+    def testAtomicWrite(self):
+        """Test that atomic writes never leave partial or temporary files"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "file")
+            with yuvcommon.atomic_write(path) as fout:
+                fout.write(b"old")
+            with self.assertRaises(ValueError):
+                with yuvcommon.atomic_write(path) as fout:
+                    fout.write(b"partial")
+                    raise ValueError
+            self.assertEqual(["file"], os.listdir(tmpdir))
+            with open(path, "rb") as fin:
+                self.assertEqual(b"old", fin.read())
+
+    def testParallelFrames(self):
+        """Test that parallel conversion matches the serial conversion"""
+        width, height, pix_fmt = 8, 4, "yuv420p"
+        frame_size = int(width * height * yuvcommon.get_length_factor(pix_fmt))
+        rng = random.Random(0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            with open(infile, "wb") as fout:
+                fout.write(bytes(rng.randrange(256) for _ in range(11 * frame_size)))
+            outputs = []
+            for jobs in (1, 3):
+                outfile = os.path.join(tmpdir, "output.%i.rgba" % jobs)
+                yuvconv.main(
+                    [
+                        "yuvconv.py",
+                        "--width",
+                        str(width),
+                        "--height",
+                        str(height),
+                        "--ipix_fmt",
+                        pix_fmt,
+                        "--opix_fmt",
+                        "rgba",
+                        "--frames",
+                        "1::2",
+                        "--jobs",
+                        str(jobs),
+                        "-i",
+                        infile,
+                        "-o",
+                        outfile,
+                    ]
+                )
+                with open(outfile, "rb") as fin:
+                    outputs.append(fin.read())
+            self.assertEqual(5 * width * height * 4, len(outputs[0]))
+            self.assertEqual(outputs[0], outputs[1])
+
+    def testParallelFramesStdout(self):
+        """Test that parallel conversion to stdout falls back to serial"""
+        width, height, pix_fmt = 8, 4, "yuv420p"
+        frame_size = int(width * height * yuvcommon.get_length_factor(pix_fmt))
+        rng = random.Random(0)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "yuvconv.py")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            with open(infile, "wb") as fout:
+                fout.write(bytes(rng.randrange(256) for _ in range(5 * frame_size)))
+            outputs = []
+            for jobs in (1, 2):
+                # no -o: the output goes to stdout
+                outputs.append(
+                    subprocess.run(
+                        [
+                            sys.executable,
+                            script,
+                            "--width",
+                            str(width),
+                            "--height",
+                            str(height),
+                            "--ipix_fmt",
+                            pix_fmt,
+                            "--opix_fmt",
+                            "rgba",
+                            "--frames",
+                            "all",
+                            "--jobs",
+                            str(jobs),
+                            "-i",
+                            infile,
+                        ],
+                        cwd=tmpdir,
+                        stdout=subprocess.PIPE,
+                        check=True,
+                    ).stdout
+                )
+            self.assertEqual(5 * width * height * 4, len(outputs[0]))
+            self.assertEqual(outputs[0], outputs[1])
+            # stdout is not a regular file named "-"
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, "-")))
+
+    def testStdinWithDashFile(self):
+        """Test that "-" reads stdin even if a "-" file exists"""
+        width, height, pix_fmt = 8, 4, "yuv420p"
+        frame_size = int(width * height * yuvcommon.get_length_factor(pix_fmt))
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "yuvconv.py")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # a stray "-" file with different contents than stdin
+            with open(os.path.join(tmpdir, "-"), "wb") as fout:
+                fout.write(bytes([0]) * frame_size)
+            # yuv420p -> yuv420p is a unit conversion: stdin goes through
+            idata = bytes([7]) * frame_size
+            odata = subprocess.run(
+                [
+                    sys.executable,
+                    script,
+                    "--width",
+                    str(width),
+                    "--height",
+                    str(height),
+                    "--ipix_fmt",
+                    pix_fmt,
+                    "--opix_fmt",
+                    pix_fmt,
+                    "--frames",
+                    "all",
+                    "-i",
+                    "-",
+                ],
+                cwd=tmpdir,
+                input=idata,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+            self.assertEqual(idata, odata)
+
 
 PIXEL_TEST_LIST = [
     [
@@ -1375,6 +1833,42 @@ class ConvertPixelTestCase(unittest.TestCase):
                     )
                 i += 1
 
+    def testConversionPlan(self):
+        """Test PIXEL_TEST_LIST using the (precompiled) conversion plans"""
+        for (
+            test_name,
+            conversion_type_list,
+            matrix_coefficients,
+            color_range_yuv,
+            color_range_rgb,
+            conversion_direction,
+            pixel_list,
+        ) in PIXEL_TEST_LIST:
+            for conversion_type in conversion_type_list:
+                plan = yuvconv.get_conversion_plan(
+                    conversion_type,
+                    conversion_direction,
+                    matrix_coefficients,
+                    color_range_yuv,
+                    color_range_rgb,
+                )
+                for pixel_in, expected_pixel_out in pixel_list:
+                    pixel_out = plan(*pixel_in)
+                    self.assertEqual(
+                        expected_pixel_out,
+                        pixel_out,
+                        f"{test_name=} {conversion_type=} {pixel_in=} {pixel_out=} {expected_pixel_out=}",
+                    )
+                # plans must also be bit-exact when run on full planes
+                a, b, c = np.array([pixel_in for pixel_in, _ in pixel_list]).T
+                plane_out = np.array(plan(a, b, c)).T.tolist()
+                expected_plane_out = [list(out) for _, out in pixel_list]
+                self.assertEqual(
+                    expected_plane_out,
+                    plane_out,
+                    f"{test_name=} {conversion_type=}",
+                )
+
 
 if __name__ == "__main__":
     unittest.main()
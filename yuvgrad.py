@@ -7,11 +7,19 @@ This module generates YUV files with smooth gradients.
 
 import argparse
 import copy
+import hashlib
+import numpy as np
+import os
+import queue
+import shutil
 import sys
+import threading
+import time
 import yuvcommon
 
-PIX_FMTS = ("yuv420p", "nv12")
-RANGE_LIST = ("full", "limited")
+PIX_FMTS = tuple(
+    pix_fmt for pix_fmt in yuvcommon.PIX_FMTS if yuvcommon.is_yuv(pix_fmt)
+)
 PREDEFINED_IMAGE_LIST = (
     "color",
     "gray",
@@ -28,32 +36,19 @@ PREDEFINED_IMAGE_LIST = (
 VALUE_LIST_RANGE = ("ymin", "ymax", "umin", "umax", "vmin", "vmax")
 VALUE_LIST_NO_RANGE = ("ygrad", "ugrad", "vgrad")
 GRAD_LIST = ("N", "S", "W", "E")
-
-yuv_range = {
-    "full": {
-        "ymin": 0,
-        "ymax": 255,
-        "umin": 0,
-        "umax": 255,
-        "vmin": 0,
-        "vmax": 255,
-    },
-    "limited": {
-        "ymin": 16,
-        "ymax": 235,
-        "umin": 16,
-        "umax": 240,
-        "vmin": 16,
-        "vmax": 240,
-    },
-}
+ANIMATION_LIST = ("none", "scroll", "rotate", "sweep")
+# gradient directions, in rotation order
+GRAD_ROTATION = ("E", "S", "W", "N")
+CACHE_VERSION = 1
+# pix_fmts of the --all batch
+BATCH_PIX_FMTS = ("yuv420p", "nv12")
 
 predefined_images = {}
 
 # color image
 predefined_images["color"] = {
-    "full": copy.deepcopy(yuv_range["full"]),
-    "limited": copy.deepcopy(yuv_range["limited"]),
+    "full": copy.deepcopy(yuvcommon.yuv_range["full"]),
+    "limited": copy.deepcopy(yuvcommon.yuv_range["limited"]),
 }
 predefined_images["color"]["ygrad"] = "E"
 predefined_images["color"]["ugrad"] = "S"
@@ -61,7 +56,7 @@ predefined_images["color"]["vgrad"] = "N"
 
 # gray image
 predefined_images["gray"] = copy.deepcopy(predefined_images["color"])
-for r in RANGE_LIST:
+for r in yuvcommon.RANGE_LIST:
     predefined_images["gray"][r]["umin"] = 128
     predefined_images["gray"][r]["umax"] = 128
     predefined_images["gray"][r]["vmin"] = 128
@@ -183,12 +178,28 @@ default_values = {
     "width": 1280,
     "height": 720,
     "pix_fmt": "yuv420p",
+    "frames": 1,
+    "duration": None,
+    "fps": 30,
+    "animation": "none",
+    "period": 60,
+    "realtime": False,
+    "ring": 4,
+    "no_cache": False,
+    "cache_dir": os.path.join("~", ".cache", "yuvtools", "yuvgrad"),
+    "cache_size": 1024,
+    "all": False,
+    "manifest": None,
+    "outdir": ".",
+    "jobs": 1,
 }
 default_values.update(predefined_images["color"]["full"])
 default_values.update(predefined_images["color"])
 
 
-def generator(xgrad, w, h, xmin, xmax):
+# returns the uint8 ramp of a gradient (along the width for E/W, and along
+# the height for S/N). Values are truncated as int(ax + bx * i) (or j)
+def get_gradient_ramp(xgrad, w, h, xmin, xmax):
     if xgrad == "E":
         # gradient is left-to-right
         # f(i) = ax + bx*i
@@ -223,17 +234,99 @@ def generator(xgrad, w, h, xmin, xmax):
 
     if xgrad in ("E", "W"):
         # vertical gradient
-        for _ in range(0, h):
-            for i in range(0, w):
-                val = ax + bx * i
-                yield (int(val))
+        ramp = ax + bx * np.arange(w)
 
     elif xgrad in ("S", "N"):
         # horizontal gradient
-        for j in range(0, h):
-            for _ in range(0, w):
-                val = ax + bx * j
-                yield (int(val))
+        ramp = ax + bx * np.arange(h)
+
+    return ramp.astype(np.int64).astype(np.uint8)
+
+
+# fill a (h, w) plane with a gradient ramp (broadcast along the other axis)
+def fill_gradient_plane(plane, xgrad, ramp):
+    if xgrad in ("E", "W"):
+        plane[:] = ramp
+    elif xgrad in ("S", "N"):
+        plane[:] = ramp[:, np.newaxis]
+
+
+# returns a (h, w) uint8 gradient plane
+def get_gradient_plane(xgrad, w, h, xmin, xmax):
+    plane = np.empty((h, w), dtype=np.uint8)
+    fill_gradient_plane(plane, xgrad, get_gradient_ramp(xgrad, w, h, xmin, xmax))
+    return plane
+
+
+# returns the gradient direction and ramp of a frame of an animation that
+# repeats every `period` frames:
+# * "none": the gradient is static
+# * "scroll": the ramp is rolled along the gradient direction
+# * "rotate": the direction rotates through E, S, W, and N
+# * "sweep": the max value sweeps from xmax to xmin and back (a
+#   triangle wave), so the gradient flattens and recovers
+def get_animated_ramp(xgrad, w, h, xmin, xmax, animation, period, frame_number):
+    phase = (frame_number % period) / period
+    if animation == "rotate":
+        rotation = int(phase * len(GRAD_ROTATION))
+        xgrad = GRAD_ROTATION[(GRAD_ROTATION.index(xgrad) + rotation) % 4]
+    elif animation == "sweep":
+        xmax = xmin + round(abs(1 - 2 * phase) * (xmax - xmin))
+    ramp = get_gradient_ramp(xgrad, w, h, xmin, xmax)
+    if animation == "scroll":
+        ramp = np.roll(ramp, int(phase * len(ramp)))
+    return xgrad, ramp
+
+
+# yields the frames (uint8 arrays using the pix_fmt layout) of a gradient
+# stream. Frames are updated in place (so each frame must be consumed
+# before getting the next one), and planes are only re-filled when their
+# (1D) ramps change. A prerendered (h, w) luma plane can be passed as
+# yplane (e.g. to share it between several images): it is used (as a
+# static plane) instead of the ygrad gradient
+def generate_gradient_frames(
+    width,
+    height,
+    ygrad,
+    ymin,
+    ymax,
+    ugrad,
+    umin,
+    umax,
+    vgrad,
+    vmin,
+    vmax,
+    pix_fmt,
+    num_frames=1,
+    animation="none",
+    period=default_values["period"],
+    yplane=None,
+):
+    sx, sy = yuvcommon.get_chroma_subsampling(pix_fmt)
+    yw, yh = width, height
+    cw, ch = width // sx, height // sy
+    gradients = (
+        (ygrad, yw, yh, ymin, ymax),
+        (ugrad, cw, ch, umin, umax),
+        (vgrad, cw, ch, vmin, vmax),
+    )
+    frame = np.zeros(yuvcommon.get_frame_size(width, height, pix_fmt), dtype=np.uint8)
+    # write the planes into the frame (using the pix_fmt layout, so
+    # interleaved chromas use a single strided assignment)
+    planes = yuvcommon.get_planes(frame, width, height, pix_fmt)
+    if yplane is not None:
+        planes[0][:] = yplane
+        planes, gradients = planes[1:], gradients[1:]
+    last_ramps = [(None, None)] * len(planes)
+    for frame_number in range(num_frames):
+        for plane_id, (plane, gradient) in enumerate(zip(planes, gradients)):
+            xgrad, ramp = get_animated_ramp(*gradient, animation, period, frame_number)
+            last_xgrad, last_ramp = last_ramps[plane_id]
+            if xgrad == last_xgrad and np.array_equal(ramp, last_ramp):
+                continue
+            fill_gradient_plane(plane, xgrad, ramp)
+            last_ramps[plane_id] = (xgrad, ramp)
+        yield frame
 
 
 def generate_gradient_file(
@@ -250,32 +343,295 @@ def generate_gradient_file(
     vmin,
     vmax,
     pix_fmt,
+    num_frames=1,
+    animation="none",
+    period=default_values["period"],
+    yplane=None,
 ):
-    # create the generators
-    yw, yh = width, height
-    cw, ch = width // 2, height // 2
-    ygen = generator(ygrad, yw, yh, ymin, ymax)
-    ugen = generator(ugrad, cw, ch, umin, umax)
-    vgen = generator(vgrad, cw, ch, vmin, vmax)
-
-    # write the luma
-    for yval in ygen:
-        fout.write(bytearray([yval]))
-
-    # write the chromas
-    if pix_fmt == "yuv420p":
-        # write the U chroma
-        for uval in ugen:
-            fout.write(bytearray([uval]))
-        # write the V chroma
-        for vval in vgen:
-            fout.write(bytearray([vval]))
-
-    elif pix_fmt == "nv12":
-        # write the U and V values interlaced
-        for uval, vval in zip(ugen, vgen):
-            fout.write(bytearray([uval]))
-            fout.write(bytearray([vval]))
+    for frame in generate_gradient_frames(
+        width,
+        height,
+        ygrad,
+        ymin,
+        ymax,
+        ugrad,
+        umin,
+        umax,
+        vgrad,
+        vmin,
+        vmax,
+        pix_fmt,
+        num_frames,
+        animation,
+        period,
+        yplane,
+    ):
+        fout.write(frame.data)
+
+
+# writes the frames into fout at `fps` frames per second, on a
+# monotonic-clock schedule. A producer thread pre-renders the frames into
+# a ring of `ring_size` frame buffers, so memory is bounded when the reader
+# applies backpressure (the producer blocks when the ring is full). Frames
+# written more than half a frame period after their deadline are late: the
+# schedule is then re-anchored, so a stalled reader does not get a burst of
+# catch-up frames. Returns the number of frames written, the number of late
+# frames, and the achieved fps
+def write_frames_paced(fout, frames, fps, ring_size, debug=0):
+    free_buffers = queue.Queue()
+    ready_buffers = queue.Queue()
+
+    def producer():
+        try:
+            for frame in frames:
+                buf = free_buffers.get()
+                if buf is None:
+                    # the writer has stopped
+                    return
+                buf[:] = frame
+                ready_buffers.put(buf)
+        finally:
+            ready_buffers.put(None)
+
+    # allocate the ring (using the first frame), and start the producer
+    frame = next(frames, None)
+    if frame is not None:
+        ready_buffers.put(frame.copy())
+        for _ in range(ring_size - 1):
+            free_buffers.put(np.empty_like(frame))
+        threading.Thread(target=producer, daemon=True).start()
+    else:
+        ready_buffers.put(None)
+
+    frame_period = 1.0 / fps
+    num_frames = num_late = 0
+    first_ts = last_ts = anchor_ts = report_ts = None
+    while True:
+        buf = ready_buffers.get()
+        if buf is None:
+            break
+        now = time.monotonic()
+        if first_ts is None:
+            first_ts = anchor_ts = report_ts = now
+        deadline = anchor_ts + num_frames * frame_period
+        if now < deadline:
+            time.sleep(deadline - now)
+        elif now - deadline > frame_period / 2:
+            num_late += 1
+            anchor_ts += now - deadline
+        try:
+            fout.write(buf.data)
+            fout.flush()
+        except BrokenPipeError:
+            discard_output(fout)
+            break
+        last_ts = time.monotonic()
+        num_frames += 1
+        free_buffers.put(buf)
+        if debug > 0 and last_ts - report_ts >= 10:
+            report_ts = last_ts
+            print_paced_stats(num_frames, num_late, first_ts, last_ts)
+    # stop the producer
+    free_buffers.put(None)
+    if debug >= 0:
+        print_paced_stats(num_frames, num_late, first_ts, last_ts)
+    return num_frames, num_late, get_achieved_fps(num_frames, first_ts, last_ts)
+
+
+# the reader went away: avoid another error when closing fout
+# (https://docs.python.org/3/library/signal.html#note-on-sigpipe)
+def discard_output(fout):
+    os.dup2(os.open(os.devnull, os.O_WRONLY), fout.fileno())
+
+
+def get_achieved_fps(num_frames, first_ts, last_ts):
+    if num_frames < 2 or last_ts == first_ts:
+        return 0.0
+    # the first frame is written at first_ts
+    return (num_frames - 1) / (last_ts - first_ts)
+
+
+# stats go to stderr (the frames may be written to stdout)
+def print_paced_stats(num_frames, num_late, first_ts, last_ts):
+    print(
+        "frames: %i late: %i fps: %.3f"
+        % (num_frames, num_late, get_achieved_fps(num_frames, first_ts, last_ts)),
+        file=sys.stderr,
+    )
+
+
+# returns the generate_gradient_file() (and generate_gradient_frames())
+# parameters (except fout)
+def get_gradient_params(options):
+    return (
+        options.width,
+        options.height,
+        options.ygrad,
+        options.ymin,
+        options.ymax,
+        options.ugrad,
+        options.umin,
+        options.umax,
+        options.vgrad,
+        options.vmin,
+        options.vmax,
+        options.pix_fmt,
+        options.frames,
+        options.animation,
+        options.period,
+    )
+
+
+# cache entries are addressed by the hash of the rendering parameters. Note
+# that predefined images (and ranges) are keyed by their (explicit) y/u/v
+# min/max/grad values
+def get_cache_path(cache_dir, params):
+    key = hashlib.sha256(repr((CACHE_VERSION,) + params).encode()).hexdigest()
+    return os.path.join(os.path.expanduser(cache_dir), "%s.yuv" % key)
+
+
+# returns the path of the cached gradient file for the options (rendering
+# and storing it on a miss), or None if the cache cannot be used (the file
+# is larger than the cache, or the cache dir is not writable)
+def get_cached_gradient_file(options):
+    params = get_gradient_params(options)
+    cache_dir = os.path.expanduser(options.cache_dir)
+    cache_path = get_cache_path(cache_dir, params)
+    max_size = options.cache_size * 1024 * 1024
+    if os.path.exists(cache_path):
+        # mark it as recently used (a read-only cache dir is not an error)
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return cache_path
+    frame_size = yuvcommon.get_frame_size(
+        options.width, options.height, options.pix_fmt
+    )
+    if frame_size * options.frames > max_size:
+        return None
+    # store it atomically
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with yuvcommon.atomic_write(cache_path) as fout:
+            generate_gradient_file(fout, *params)
+        yuvcommon.evict_cache(cache_dir, max_size, "*.yuv", cache_path)
+    except OSError:
+        return None
+    return cache_path
+
+
+# batch jobs are (predefined, range, pix_fmt, width, height, outfile)
+# tuples. Default outfile names follow the image/ directory convention
+# (e.g. "sdtv.uv.nv12.fr.yuv"), adding the size when it is not the default
+def get_batch_outfile(outdir, predefined, range_, pix_fmt, width, height):
+    name = predefined
+    if (width, height) != (default_values["width"], default_values["height"]):
+        name += ".%ix%i" % (width, height)
+    name += ".%s.%s.yuv" % (pix_fmt, "fr" if range_ == "full" else "lr")
+    return os.path.join(outdir, name)
+
+
+# the whole predefined matrix (images x ranges x batch pix_fmts), at the
+# --width/--height size
+def get_all_batch_jobs(options):
+    jobs = []
+    for predefined in PREDEFINED_IMAGE_LIST:
+        for range_ in yuvcommon.RANGE_LIST:
+            for pix_fmt in BATCH_PIX_FMTS:
+                width, height = options.width, options.height
+                outfile = get_batch_outfile(
+                    options.outdir, predefined, range_, pix_fmt, width, height
+                )
+                jobs.append((predefined, range_, pix_fmt, width, height, outfile))
+    return jobs
+
+
+# manifest files contain a "PREDEFINED RANGE PIX_FMT WIDTHxHEIGHT [OUTFILE]"
+# line per job (empty lines and lines starting with "#" are ignored)
+def get_manifest_batch_jobs(options):
+    jobs = []
+    with open(options.manifest) as fin:
+        for line_number, line in enumerate(fin, start=1):
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) not in (4, 5):
+                print("error: invalid manifest line %i: %s" % (line_number, line))
+                sys.exit(-1)
+            predefined, range_, pix_fmt, size = fields[:4]
+            try:
+                width, height = [int(v) for v in size.split("x")]
+            except ValueError:
+                # malformed size (e.g. "1920x" or "1080p")
+                width = height = 0
+            if (
+                predefined not in PREDEFINED_IMAGE_LIST
+                or range_ not in yuvcommon.RANGE_LIST
+                or pix_fmt not in PIX_FMTS
+                or width <= 0
+                or height <= 0
+            ):
+                print("error: invalid manifest line %i: %s" % (line_number, line))
+                sys.exit(-1)
+            if len(fields) == 5:
+                outfile = os.path.join(options.outdir, fields[4])
+            else:
+                outfile = get_batch_outfile(
+                    options.outdir, predefined, range_, pix_fmt, width, height
+                )
+            jobs.append((predefined, range_, pix_fmt, width, height, outfile))
+    return jobs
+
+
+# returns the (grad, min, max) luma, u chroma, and v chroma values of a
+# predefined image
+def get_predefined_gradients(predefined, range_):
+    image = predefined_images[predefined]
+    return tuple(
+        (image["%sgrad" % c], image[range_]["%smin" % c], image[range_]["%smax" % c])
+        for c in "yuv"
+    )
+
+
+# renders a group of batch jobs that share the same luma plane (size and
+# luma gradient), so the luma plane is only rendered once. Returns the
+# written outfiles
+def render_batch_group(jobs):
+    _, _, _, width, height, _ = jobs[0]
+    (ygrad, ymin, ymax), _, _ = get_predefined_gradients(*jobs[0][:2])
+    yplane = get_gradient_plane(ygrad, width, height, ymin, ymax)
+    outfiles = []
+    for predefined, range_, pix_fmt, _, _, outfile in jobs:
+        gradients = get_predefined_gradients(predefined, range_)
+        with open(outfile, "wb") as fout:
+            generate_gradient_file(
+                fout,
+                width,
+                height,
+                *[value for gradient in gradients for value in gradient],
+                pix_fmt,
+                yplane=yplane,
+            )
+        outfiles.append(outfile)
+    return outfiles
+
+
+# renders the batch jobs using a pool of --jobs workers (one task per group
+# of jobs sharing a luma plane), and reports the files as they are written
+def render_batch(options, jobs):
+    groups = {}
+    for job in jobs:
+        predefined, range_, _, width, height, _ = job
+        yvalues, _, _ = get_predefined_gradients(predefined, range_)
+        groups.setdefault((width, height, yvalues), []).append(job)
+    os.makedirs(options.outdir, exist_ok=True)
+    for _, outfiles in yuvcommon.run_in_pool(
+        options.jobs, render_batch_group, [(group,) for group in groups.values()]
+    ):
+        for outfile in outfiles:
+            if options.debug >= 0:
+                print("wrote %s" % outfile)
 
 
 def get_options(argv):
@@ -424,7 +780,7 @@ def get_options(argv):
         "--range",
         action=CustomAction,
         nargs=1,
-        choices=RANGE_LIST,
+        choices=yuvcommon.RANGE_LIST,
         help="use RANGE for Y, U, V",
     )
     parser.add_argument(
@@ -491,6 +847,143 @@ def get_options(argv):
         metavar="VGRAD",
         help=("v gradient %r (default: %s)" % (GRAD_LIST, default_values["vgrad"])),
     )
+    parser.add_argument(
+        "--frames",
+        action="store",
+        type=int,
+        dest="frames",
+        default=default_values["frames"],
+        metavar="FRAMES",
+        help=("number of frames (default: %i)" % default_values["frames"]),
+    )
+    parser.add_argument(
+        "--duration",
+        action="store",
+        type=float,
+        dest="duration",
+        default=default_values["duration"],
+        metavar="SECONDS",
+        help="stream duration, at --fps (overrides --frames)",
+    )
+    parser.add_argument(
+        "--fps",
+        action="store",
+        type=float,
+        dest="fps",
+        default=default_values["fps"],
+        metavar="FPS",
+        help=("frame rate (default: %s)" % default_values["fps"]),
+    )
+    parser.add_argument(
+        "--animation",
+        action="store",
+        type=str,
+        dest="animation",
+        default=default_values["animation"],
+        choices=ANIMATION_LIST,
+        metavar="ANIMATION",
+        help=(
+            "gradient animation %r (default: %s)"
+            % (ANIMATION_LIST, default_values["animation"])
+        ),
+    )
+    parser.add_argument(
+        "--period",
+        action="store",
+        type=int,
+        dest="period",
+        default=default_values["period"],
+        metavar="PERIOD",
+        help=(
+            "repeat the animation every PERIOD frames (default: %i)"
+            % default_values["period"]
+        ),
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        dest="realtime",
+        default=default_values["realtime"],
+        help="write the frames in real time (paced at --fps)",
+    )
+    parser.add_argument(
+        "--ring",
+        action="store",
+        type=int,
+        dest="ring",
+        default=default_values["ring"],
+        metavar="RING",
+        help=(
+            "number of pre-rendered frames in --realtime mode (default: %i)"
+            % default_values["ring"]
+        ),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        dest="no_cache",
+        default=default_values["no_cache"],
+        help="do not use (or fill) the rendered gradient cache",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        action="store",
+        type=str,
+        dest="cache_dir",
+        default=default_values["cache_dir"],
+        metavar="CACHE_DIR",
+        help=(
+            "rendered gradient cache directory (default: %s)"
+            % default_values["cache_dir"]
+        ),
+    )
+    parser.add_argument(
+        "--cache_size",
+        action="store",
+        type=int,
+        dest="cache_size",
+        default=default_values["cache_size"],
+        metavar="MBYTES",
+        help=(
+            "max rendered gradient cache size, in MB (default: %i)"
+            % default_values["cache_size"]
+        ),
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        dest="all",
+        default=default_values["all"],
+        help=(
+            "render all the predefined images, in all the ranges, and in the "
+            "%r pix_fmts (into --outdir)" % (BATCH_PIX_FMTS,)
+        ),
+    )
+    parser.add_argument(
+        "--manifest",
+        action="store",
+        type=str,
+        dest="manifest",
+        default=default_values["manifest"],
+        metavar="MANIFEST",
+        help=(
+            "render the images in MANIFEST (into --outdir), one "
+            '"PREDEFINED RANGE PIX_FMT WIDTHxHEIGHT [OUTFILE]" per line'
+        ),
+    )
+    parser.add_argument(
+        "--outdir",
+        action="store",
+        type=str,
+        dest="outdir",
+        default=default_values["outdir"],
+        metavar="OUTDIR",
+        help=(
+            "output directory for --all and --manifest (default: %s)"
+            % default_values["outdir"]
+        ),
+    )
+    yuvcommon.add_jobs_argument(parser, default_values["jobs"], "--all and --manifest")
     parser.add_argument(
         "-o",
         "--outfile",
@@ -502,6 +995,32 @@ def get_options(argv):
     )
     # do the parsing
     options = parser.parse_args(argv[1:])
+    if options.fps <= 0:
+        print("error: invalid frame rate: %s" % options.fps)
+        sys.exit(-1)
+    if options.jobs < 0:
+        print("error: invalid number of jobs: %i" % options.jobs)
+        sys.exit(-1)
+    if options.duration is not None:
+        options.frames = round(options.duration * options.fps)
+    if options.frames < 0:
+        print("error: invalid number of frames: %i" % options.frames)
+        sys.exit(-1)
+    if options.period < 1:
+        print("error: invalid animation period: %i" % options.period)
+        sys.exit(-1)
+    # batches render single (still) images
+    if (options.all or options.manifest is not None) and (
+        options.frames != default_values["frames"]
+        or options.animation != default_values["animation"]
+        or options.realtime
+    ):
+        print(
+            "error: --all and --manifest do not support --frames, --duration, "
+            "--animation, or --realtime"
+        )
+        sys.exit(-1)
+    options.jobs = yuvcommon.get_num_jobs(options.jobs)
     return options
 
 
@@ -514,6 +1033,30 @@ def main(argv):
     # print results
     if options.debug > 0:
         print(options)
+    # batch mode
+    if options.all or options.manifest is not None:
+        jobs = []
+        if options.all:
+            jobs += get_all_batch_jobs(options)
+        if options.manifest is not None:
+            jobs += get_manifest_batch_jobs(options)
+        render_batch(options, jobs)
+        return
+    # serve repeated still images from the cache. Streams are not cached:
+    # they are rendered while being written
+    cache_path = None
+    if (
+        not options.realtime
+        and not options.no_cache
+        and options.frames == 1
+        and options.animation == "none"
+    ):
+        cache_path = get_cached_gradient_file(options)
+    if cache_path is not None and options.outfile != sys.stdout:
+        # copy (instead of hardlinking) so that changes to the output file
+        # cannot corrupt the cache
+        shutil.copyfile(cache_path, options.outfile)
+        return
     # open outfile
     if options.outfile != sys.stdout:
         try:
@@ -523,21 +1066,17 @@ def main(argv):
     else:
         fout = sys.stdout.buffer
     # generate gradient file
-    generate_gradient_file(
-        fout,
-        options.width,
-        options.height,
-        options.ygrad,
-        options.ymin,
-        options.ymax,
-        options.ugrad,
-        options.umin,
-        options.umax,
-        options.vgrad,
-        options.vmin,
-        options.vmax,
-        options.pix_fmt,
-    )
+    try:
+        if cache_path is not None:
+            with open(cache_path, "rb") as fin:
+                shutil.copyfileobj(fin, fout)
+        elif options.realtime:
+            frames = generate_gradient_frames(*get_gradient_params(options))
+            write_frames_paced(fout, frames, options.fps, options.ring, options.debug)
+        else:
+            generate_gradient_file(fout, *get_gradient_params(options))
+    except BrokenPipeError:
+        discard_output(fout)
     # close the file
     fout.close()
 
@@ -5,7 +5,13 @@
 # http://www.voidspace.org.uk/python/articles/introduction-to-unittest.shtml
 
 import binascii
+import contextlib
+import numpy as np
+import os
+import tempfile
+import time
 import unittest
+import unittest.mock
 import io
 
 import yuvgrad
@@ -56,6 +62,34 @@ TEST_LIST = [
         ff7f ff7f ff7f ff7f ff7f ff7f ff7f ff7f
     """,
     ],
+    [
+        15,
+        9,
+        "E",
+        10,
+        19,
+        "S",
+        0,
+        255,
+        "N",
+        127,
+        127,
+        "nv12",
+        """
+        0a0a 0b0b 0c0d 0d0e 0f0f 1011 1112 130a
+        0a0b 0b0c 0d0d 0e0f 0f10 1111 1213 0a0a
+        0b0b 0c0d 0d0e 0f0f 1011 1112 130a 0a0b
+        0b0c 0d0d 0e0f 0f10 1111 1213 0a0a 0b0b
+        0c0d 0d0e 0f0f 1011 1112 130a 0a0b 0b0c
+        0d0d 0e0f 0f10 1111 1213 0a0a 0b0b 0c0d
+        0d0e 0f0f 1011 1112 130a 0a0b 0b0c 0d0d
+        0e0f 0f10 1111 1213 0a0a 0b0b 0c0d 0d0e
+        0f0f 1011 1112 1300 7f00 7f00 7f00 7f00
+        7f00 7f00 7f55 7f55 7f55 7f55 7f55 7f55
+        7f55 7faa 7faa 7faa 7faa 7faa 7faa 7faa
+        7fff 7fff 7fff 7fff 7fff 7fff 7fff 7f
+    """,
+    ],
 ]
 
 
@@ -99,6 +133,196 @@ class GenerateGradientFileTestCase(unittest.TestCase):
             )
             self.assertEqual(expected_contents, contents)
 
+    def testAnimation(self):
+        """Test the animated gradient streams frame by frame"""
+        width, height, period = 16, 8, 4
+        for pix_fmt in ("yuv420p", "nv12"):
+            for animation in yuvgrad.ANIMATION_LIST:
+                fout = io.BytesIO()
+                yuvgrad.generate_gradient_file(
+                    fout,
+                    width,
+                    height,
+                    "E",
+                    16,
+                    235,
+                    "S",
+                    16,
+                    240,
+                    "N",
+                    0,
+                    255,
+                    pix_fmt,
+                    2 * period,
+                    animation,
+                    period,
+                )
+                frames = np.frombuffer(fout.getvalue(), dtype=np.uint8).reshape(
+                    2 * period, -1
+                )
+                for frame_number, frame in enumerate(frames):
+                    ydata, udata, vdata = yuvgrad.yuvcommon.get_planes(
+                        frame, width, height, pix_fmt
+                    )
+                    phase = frame_number % period
+                    yexpected = yuvgrad.get_gradient_plane("E", width, height, 16, 235)
+                    uexpected = yuvgrad.get_gradient_plane("S", 8, 4, 16, 240)
+                    if animation == "scroll":
+                        yexpected = np.roll(yexpected, phase * width // period, 1)
+                        uexpected = np.roll(uexpected, phase * 4 // period, 0)
+                    elif animation == "rotate":
+                        ygrad = ("E", "S", "W", "N")[phase]
+                        yexpected = yuvgrad.get_gradient_plane(
+                            ygrad, width, height, 16, 235
+                        )
+                    elif animation == "sweep":
+                        ymax = 16 + round(abs(1 - 2 * phase / period) * (235 - 16))
+                        yexpected = yuvgrad.get_gradient_plane(
+                            "E", width, height, 16, ymax
+                        )
+                    np.testing.assert_array_equal(yexpected, ydata)
+                    if animation in ("none", "scroll"):
+                        np.testing.assert_array_equal(uexpected, udata)
+        # invalid periods, numbers of frames, frame rates, and numbers of
+        # jobs are rejected
+        for argv in (
+            ["--animation", "scroll", "--period", "0"],
+            ["--frames", "-1"],
+            ["--duration", "-1"],
+            ["--fps", "0", "--realtime"],
+            ["--fps", "-30", "--duration", "5"],
+            ["--jobs", "-1", "--all"],
+        ):
+            with self.assertRaises(SystemExit), contextlib.redirect_stdout(
+                io.StringIO()
+            ):
+                yuvgrad.get_options(["yuvgrad.py"] + argv)
+
+    def testPacedFrames(self):
+        """Test that paced frames match the unpaced ones, and are paced"""
+        args = (
+            16,
+            8,
+            "E",
+            16,
+            235,
+            "S",
+            16,
+            240,
+            "N",
+            16,
+            240,
+            "nv12",
+            10,
+            "scroll",
+            4,
+        )
+        fout = io.BytesIO()
+        yuvgrad.generate_gradient_file(fout, *args)
+        expected_contents = fout.getvalue()
+        fout = io.BytesIO()
+        start_ts = time.monotonic()
+        num_frames, _, fps = yuvgrad.write_frames_paced(
+            fout, yuvgrad.generate_gradient_frames(*args), 200, 3, -1
+        )
+        self.assertGreaterEqual(time.monotonic() - start_ts, 9 / 200)
+        self.assertEqual(10, num_frames)
+        self.assertLessEqual(fps, 200 * 1.01)
+        self.assertEqual(expected_contents, fout.getvalue())
+
+    def testCache(self):
+        """Test that the cache serves repeated requests, and evicts LRU ones"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_dir = os.path.join(tmpdir, "cache")
+            argv = ["yuvgrad.py", "--video_size", "1024x512", "--cache_dir", cache_dir]
+            outputs = {}
+            for predefined in ("color", "gray", "color", "sdtv.y"):
+                for cache_argv in ([], ["--no-cache"]):
+                    outfile = os.path.join(tmpdir, "out.yuv")
+                    # 1024x512 yuv420p frames are 0.75 MB (a 1 MB cache fits one)
+                    yuvgrad.main(
+                        argv
+                        + ["--predefined", predefined, "--cache_size", "1"]
+                        + cache_argv
+                        + ["-o", outfile]
+                    )
+                    with open(outfile, "rb") as fin:
+                        outputs.setdefault(predefined, []).append(fin.read())
+                # cache entries only hold the last image
+                self.assertEqual(1, len(os.listdir(cache_dir)))
+            for contents in outputs.values():
+                self.assertEqual(1024 * 512 * 3 // 2, len(contents[0]))
+                self.assertEqual([contents[0]] * len(contents), contents)
+            self.assertNotEqual(outputs["color"][0], outputs["gray"][0])
+            # a read-only cache entry is still served
+            with unittest.mock.patch("os.utime", side_effect=PermissionError):
+                yuvgrad.main(argv + ["--predefined", "sdtv.y", "-o", outfile])
+            with open(outfile, "rb") as fin:
+                self.assertEqual(outputs["sdtv.y"][0], fin.read())
+            # streams are not cached
+            for stream_argv in (["--frames", "2"], ["--animation", "scroll"]):
+                yuvgrad.main(argv + stream_argv + ["-o", outfile])
+                self.assertEqual(1, len(os.listdir(cache_dir)))
+
+    def testBatch(self):
+        """Test that manifest batches match the single-image outputs"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = os.path.join(tmpdir, "manifest.txt")
+            with open(manifest, "w") as fout:
+                fout.write("# predefined range pix_fmt size [outfile]\n")
+                fout.write("color full yuv420p 16x8\n")
+                fout.write("gray full nv12 16x8\n")
+                fout.write("sdtv.uv limited nv12 32x4 sdtv.yuv\n")
+            yuvgrad.main(
+                ["yuvgrad.py", "--quiet", "--manifest", manifest, "--outdir", tmpdir]
+                + ["--jobs", "2"]
+            )
+            for predefined, range_, pix_fmt, width, height, outfile in (
+                ("color", "full", "yuv420p", 16, 8, "color.16x8.yuv420p.fr.yuv"),
+                ("gray", "full", "nv12", 16, 8, "gray.16x8.nv12.fr.yuv"),
+                ("sdtv.uv", "limited", "nv12", 32, 4, "sdtv.yuv"),
+            ):
+                image = yuvgrad.predefined_images[predefined]
+                expected = io.BytesIO()
+                yuvgrad.generate_gradient_file(
+                    expected,
+                    width,
+                    height,
+                    *[
+                        value
+                        for c in "yuv"
+                        for value in (
+                            image["%sgrad" % c],
+                            image[range_]["%smin" % c],
+                            image[range_]["%smax" % c],
+                        )
+                    ],
+                    pix_fmt,
+                )
+                with open(os.path.join(tmpdir, outfile), "rb") as fin:
+                    self.assertEqual(expected.getvalue(), fin.read())
+            # batches only render still images
+            for argv in (
+                ["--frames", "2"],
+                ["--duration", "1"],
+                ["--animation", "scroll"],
+                ["--realtime"],
+            ):
+                with self.assertRaises(SystemExit), contextlib.redirect_stdout(
+                    io.StringIO()
+                ):
+                    yuvgrad.get_options(["yuvgrad.py", "--manifest", manifest] + argv)
+            # malformed manifest lines are rejected
+            for size in ("1920x", "1080p", "0x8"):
+                with open(manifest, "w") as fout:
+                    fout.write("color full yuv420p %s\n" % size)
+                with self.assertRaises(SystemExit), contextlib.redirect_stdout(
+                    io.StringIO()
+                ):
+                    yuvgrad.main(
+                        ["yuvgrad.py", "--manifest", manifest, "--outdir", tmpdir]
+                    )
+
 
 if __name__ == "__main__":
     unittest.main()
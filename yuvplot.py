@@ -8,8 +8,8 @@ from __future__ import print_function
 import sys
 import os
 import os.path
-import matplotlib.pyplot as plt
-import matplotlib.colors as clr
+import csv
+import json
 import numpy as np
 import argparse
 import yuvcommon
@@ -18,38 +18,153 @@ FONTSIZE_SMALL = 10
 FONTSIZE_MEDIUM = 11
 FONTSIZE_BIG = 16
 
-PIX_FMTS = ["yuv420p", "nv12"]
+# plots use 4:2:0 chroma planes
+PIX_FMTS = [
+    pix_fmt
+    for pix_fmt in yuvcommon.PIX_FMTS
+    if yuvcommon.is_yuv(pix_fmt) and yuvcommon.get_chroma_subsampling(pix_fmt) == (2, 2)
+]
 
 IMAGE_NAME = None
 
 PIXEL_RANGE = range(0, 256)
 DIFF_PIXEL_RANGE = range(-255, 256)
 IMAGE_EXT = "png"
+DATA_FORMATS = ("json", "csv", "npz")
 
+METRICS = ("psnr", "mse", "maxabs", "ssim", "over")
+METRICS_FORMATS = ("csv", "json")
+SUMMARY_PERCENTILES = (0, 5, 50, 95, 100)
+# SSIM stabilization constants (K1 = 0.01, K2 = 0.03, L = 255)
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
 
-# get the histogram of pixel values
-def get_pixel_histogram(w, h, data, not_a_diff):
+TREND_STATS = ("mean", "std", "min", "max", "below", "above")
+TREND_CACHE_VERSION = 1
+
+BLOCK_STATS = ("mean", "var", "energy")
+
+# matplotlib is only imported when a figure is rendered (see
+# import_matplotlib())
+plt = None
+clr = None
+
+
+# import matplotlib, using the (non-interactive) Agg backend, as figures
+# are only saved to files
+def import_matplotlib():
+    global plt, clr
+    if plt is not None:
+        return
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import matplotlib.colors as clr
+
+
+# get the histograms of pixel values of several planes (e.g. Y, U, and V),
+# using one np.bincount() pass per plane. Diffs use the -255..255 range.
+def get_pixel_histograms(planes, not_a_diff):
     # assume FR (full-range)
     xdata = PIXEL_RANGE if not_a_diff else DIFF_PIXEL_RANGE
-    hist = [0] * (256 if not_a_diff else 511)
-    for y in range(h):
-        for x in range(w):
-            val = int(data[y][x])
-            if not not_a_diff:
-                val += 256
-            hist[val] += 1
+    hists = []
+    for data in planes:
+        data = np.asarray(data)
+        if data.dtype.kind == "f":
+            # int() semantics (truncate towards zero)
+            data = np.trunc(data).astype(np.int64)
+        if not not_a_diff:
+            data = data.astype(np.int16) - xdata.start
+        hists.append(np.bincount(data.ravel(), minlength=len(xdata)))
+    return xdata, hists
+
+
+# get the histogram of pixel values
+def get_pixel_histogram(w, h, data, not_a_diff):
+    xdata, (hist,) = get_pixel_histograms([np.asarray(data)[:h, :w]], not_a_diff)
     return xdata, hist
 
 
-# get a distribution of pixel values for a given coordinate
-def get_pixel_distribution(w, h, data, calc_axis=0):
+# get a distribution of pixel values for a given coordinate, as a (value,
+# coordinate) matrix of counts, using a single 2D np.bincount() call.
+# Diffs use the -255..255 range (row 0 is -255).
+def get_pixel_distribution(w, h, data, calc_axis=0, not_a_diff=True):
     # horizontal \eq (calc_axis == 0)
-    distro = np.zeros((256, w if calc_axis == 0 else h))
-    for y in range(h):
-        for x in range(w):
-            val = int(data[y][x])
-            distro[val][x if calc_axis == 0 else y] += 1
-    return distro
+    yrange = PIXEL_RANGE if not_a_diff else DIFF_PIXEL_RANGE
+    data = np.asarray(data)[:h, :w]
+    if data.dtype.kind == "f":
+        # int() semantics (truncate towards zero)
+        data = np.trunc(data)
+    values = data.astype(np.int64) - yrange.start
+    # coordinate of each pixel
+    size = w if calc_axis == 0 else h
+    coordinates = np.arange(size).reshape((1, w) if calc_axis == 0 else (h, 1))
+    distro = np.bincount(
+        (values * size + coordinates).ravel(), minlength=len(yrange) * size
+    )
+    return distro.reshape(len(yrange), size)
+
+
+# streaming statistics of a plane over a sequence of frames. Memory usage
+# is constant in the number of frames. Keeps:
+# * the minimum and maximum values
+# * (func == "hist") the summed histogram
+# * (func == "map") the summed distribution maps (per axis)
+# * (func == "distro") the running mean and variance of each column (axis
+#   0) and row (axis 1), using Chan et al.'s parallel version of Welford's
+#   algorithm (each frame is merged as a batch)
+class PlaneStats:
+    def __init__(self, func, not_a_diff):
+        self.func = func
+        self.not_a_diff = not_a_diff
+        self.num_frames = 0
+        self.min = None
+        self.max = None
+        self.hist = None
+        self.distro = [None, None]
+        self.count = [0, 0]
+        self.mean = [None, None]
+        self.m2 = [None, None]
+
+    def update(self, data):
+        self.num_frames += 1
+        vmin, vmax = int(data.min()), int(data.max())
+        self.min = vmin if self.min is None else min(self.min, vmin)
+        self.max = vmax if self.max is None else max(self.max, vmax)
+        h, w = data.shape
+        if self.func == "hist":
+            _, (hist,) = get_pixel_histograms([data], self.not_a_diff)
+            self.hist = hist if self.hist is None else self.hist + hist
+        elif self.func == "map":
+            for calc_axis in (0, 1):
+                distro = get_pixel_distribution(w, h, data, calc_axis, self.not_a_diff)
+                if self.distro[calc_axis] is not None:
+                    distro += self.distro[calc_axis]
+                self.distro[calc_axis] = distro
+        elif self.func == "distro":
+            for calc_axis in (0, 1):
+                count = data.shape[calc_axis]
+                mean = np.mean(data, axis=calc_axis)
+                m2 = np.var(data, axis=calc_axis) * count
+                if self.mean[calc_axis] is None:
+                    self.count[calc_axis] = count
+                    self.mean[calc_axis] = mean
+                    self.m2[calc_axis] = m2
+                    continue
+                total = self.count[calc_axis] + count
+                delta = mean - self.mean[calc_axis]
+                self.mean[calc_axis] = self.mean[calc_axis] + delta * count / total
+                self.m2[calc_axis] = (
+                    self.m2[calc_axis]
+                    + m2
+                    + delta**2 * self.count[calc_axis] * count / total
+                )
+                self.count[calc_axis] = total
+
+    # standard deviation of each column (axis 0) or row (axis 1)
+    def std(self, calc_axis):
+        return np.sqrt(self.m2[calc_axis] / self.count[calc_axis])
 
 
 # plot a histogram of luma and/or chromas
@@ -62,10 +177,10 @@ def plot_histogram_help(
     plt.xlabel(xlabel, fontsize=FONTSIZE_SMALL)
     plt.ylabel(ylabel, fontsize=FONTSIZE_SMALL)
     plt.minorticks_on()
-    plt.grid(b=True, which="minor", color="#999999", linestyle="-", alpha=0.2)
+    plt.grid(True, which="minor", color="#999999", linestyle="-", alpha=0.2)
 
 
-def plot_histogram(source, name, options, ydata, udata, vdata):
+def plot_histogram(source, name, options, ystats, ustats, vstats):
     title = "%s (%s) %s Histogram" % (
         name,
         source,
@@ -73,9 +188,6 @@ def plot_histogram(source, name, options, ydata, udata, vdata):
     )
 
     fig = plt.figure(num=title, figsize=options.figsize)
-    # chroma (4:2:0) dimensions
-    w, h = options.width, options.height
-    cw, ch = int(w / 2), int(h / 2)
 
     # get layout
     rows = 0
@@ -86,10 +198,12 @@ def plot_histogram(source, name, options, ydata, udata, vdata):
     plotsize = (rows, 1)
     row_id = 0
 
+    xdata = PIXEL_RANGE if options.diff is None else DIFF_PIXEL_RANGE
+    yhist, uhist, vhist = ystats.hist, ustats.hist, vstats.hist
+
     # print luma
     if not options.no_luma:
         location = (row_id, 0)
-        xdata, yhist = get_pixel_histogram(w, h, ydata, options.diff is None)
         plot_histogram_help(xdata, yhist, plotsize, location, 1, 1, "Y", "Y (luma)")
         fig.set_facecolor("w")
         row_id += 1
@@ -98,7 +212,6 @@ def plot_histogram(source, name, options, ydata, udata, vdata):
     if not options.no_chroma:
         # print U
         location = (row_id, 0)
-        xdata, uhist = get_pixel_histogram(cw, ch, udata, options.diff is None)
         plot_histogram_help(
             xdata, uhist, plotsize, location, 1, 1, "Cb", "Cb (U chroma)"
         )
@@ -106,7 +219,6 @@ def plot_histogram(source, name, options, ydata, udata, vdata):
         row_id += 1
         # print V
         location = (row_id, 0)
-        xdata, vhist = get_pixel_histogram(cw, ch, vdata, options.diff is None)
         plot_histogram_help(
             xdata, vhist, plotsize, location, 1, 1, "Cr", "Cr (V chroma)"
         )
@@ -117,6 +229,7 @@ def plot_histogram(source, name, options, ydata, udata, vdata):
     plt.tight_layout()
     plt.subplots_adjust(top=0.85)
     fig.savefig("%s.hist.%s" % (source, IMAGE_EXT))
+    plt.close(fig)
 
 
 def plot_distribution_help(datax, datay1, datay2, name, color):
@@ -126,7 +239,9 @@ def plot_distribution_help(datax, datay1, datay2, name, color):
     # line.set_label('%s.sttdev' % name)
 
 
-def plot_distribution(source, name, options, ydata, udata, vdata, calc_axis):
+def plot_distribution(
+    source, name, options, ystats, ustats, vstats, dstats, calc_axis
+):
     orientation = "horizontal" if calc_axis == 0 else "vertical"
     title = "%s %s Distribution" % (
         orientation,
@@ -134,24 +249,20 @@ def plot_distribution(source, name, options, ydata, udata, vdata, calc_axis):
     )
 
     fig = plt.figure(num=title, figsize=options.figsize)
-    # chroma (4:2:0) dimensions
-    w, h = options.width, options.height
-    cw, ch = w // 2, h // 2
-    yplotrange = w if calc_axis == 0 else h
-    cplotrange = cw if calc_axis == 0 else ch
+    yplotrange = len(ystats.mean[calc_axis])
+    cplotrange = len(ustats.mean[calc_axis])
     xlabel = "width" if calc_axis == 0 else "height"
-    ddata = udata - vdata
     # get plot limits
     y_ymax = 255
     y_ymin = 0
     c_ymax = 255
     c_ymin = 0
     if options.diff is not None:
-        y_ymin = min(y_ymin, int(np.amin(ydata)))
-        c_ymin = min(c_ymin, int(np.amin(udata)))
-        c_ymin = min(c_ymin, int(np.amin(vdata)))
+        y_ymin = min(y_ymin, ystats.min)
+        c_ymin = min(c_ymin, ustats.min)
+        c_ymin = min(c_ymin, vstats.min)
     if not options.no_uvdiff:
-        c_ymin = min(c_ymin, int(np.amin(ddata)))
+        c_ymin = min(c_ymin, dstats.min)
     y_ylim = (y_ymin * 1.1, y_ymax)
     c_ylim = (c_ymin * 1.1, c_ymax)
 
@@ -168,15 +279,15 @@ def plot_distribution(source, name, options, ydata, udata, vdata, calc_axis):
     if not options.no_luma:
         location = (row_id, 0)
         xdata = range(yplotrange)
-        ymean = np.mean(ydata, axis=calc_axis)
-        ystddev = np.std(ydata, axis=calc_axis)
+        ymean = ystats.mean[calc_axis]
+        ystddev = ystats.std(calc_axis)
         plt.subplot2grid(plotsize, location, 1, 1)
         plot_distribution_help(xdata, ymean, ystddev, name, "0.5")
         plt.grid()
         plt.xlabel("Y", fontsize=FONTSIZE_SMALL)
         plt.ylabel("Y", fontsize=FONTSIZE_SMALL)
         plt.minorticks_on()
-        plt.grid(b=True, which="minor", color="#999999", linestyle="-", alpha=0.2)
+        plt.grid(True, which="minor", color="#999999", linestyle="-", alpha=0.2)
         plt.legend()
         fig.set_facecolor("w")
         ax = fig.get_axes()
@@ -187,12 +298,12 @@ def plot_distribution(source, name, options, ydata, udata, vdata, calc_axis):
     if not options.no_chroma:
         location = (row_id, 0)
         xdata = range(cplotrange)
-        umean = np.mean(udata, axis=calc_axis)
-        ustddev = np.std(udata, axis=calc_axis)
-        vmean = np.mean(vdata, axis=calc_axis)
-        vstddev = np.std(vdata, axis=calc_axis)
-        dmean = np.mean(ddata, axis=calc_axis)
-        dstddev = np.std(ddata, axis=calc_axis)
+        umean = ustats.mean[calc_axis]
+        ustddev = ustats.std(calc_axis)
+        vmean = vstats.mean[calc_axis]
+        vstddev = vstats.std(calc_axis)
+        dmean = dstats.mean[calc_axis]
+        dstddev = dstats.std(calc_axis)
         # print U, V, and the UV diff
         plt.subplot2grid(plotsize, location, 1, 1)
         plot_distribution_help(xdata, umean, ustddev, "%s.U" % name, "b")
@@ -203,7 +314,7 @@ def plot_distribution(source, name, options, ydata, udata, vdata, calc_axis):
         plt.xlabel(xlabel, fontsize=FONTSIZE_SMALL)
         plt.ylabel("chroma", fontsize=FONTSIZE_SMALL)
         plt.minorticks_on()
-        plt.grid(b=True, which="minor", color="#999999", linestyle="-", alpha=0.2)
+        plt.grid(True, which="minor", color="#999999", linestyle="-", alpha=0.2)
         plt.legend()
         fig.set_facecolor("w")
         ax = fig.get_axes()
@@ -216,12 +327,15 @@ def plot_distribution(source, name, options, ydata, udata, vdata, calc_axis):
     return fig
 
 
-def plot_map_help(datay, plotsize, location, rowspan, colspan, title, xlabel, ylabel):
+def plot_map_help(
+    datay, plotsize, location, rowspan, colspan, title, xlabel, ylabel, ymin=0
+):
     plt.subplot2grid(plotsize, location, colspan=colspan, rowspan=rowspan)
     image = plt.imshow(
         datay,
         aspect="auto",
         origin="lower",
+        extent=(0, datay.shape[1], ymin, ymin + datay.shape[0]),
         norm=clr.LogNorm(vmin=1 + datay.min(), vmax=1 + datay.max()),
         cmap=plt.cm.pink.reversed(),
     )
@@ -232,7 +346,7 @@ def plot_map_help(datay, plotsize, location, rowspan, colspan, title, xlabel, yl
     return image
 
 
-def plot_map(source, name, options, ydata, udata, vdata, calc_axis):
+def plot_map(source, name, options, ystats, ustats, vstats, calc_axis):
     orientation = "horizontal" if calc_axis == 0 else "vertical"
     title = "%s (%s) %s %s Map" % (
         name,
@@ -242,10 +356,9 @@ def plot_map(source, name, options, ydata, udata, vdata, calc_axis):
     )
 
     fig = plt.figure(num=title, figsize=options.figsize)
-    # chroma (4:2:0) dimensions
-    w, h = options.width, options.height
-    cw, ch = int(w / 2), int(h / 2)
     xlabel = "width" if calc_axis == 0 else "height"
+    not_a_diff = options.diff is None
+    ymin = (PIXEL_RANGE if not_a_diff else DIFF_PIXEL_RANGE).start
 
     # get layout
     rows = 0
@@ -259,9 +372,9 @@ def plot_map(source, name, options, ydata, udata, vdata, calc_axis):
     # print luma
     if not options.no_luma:
         location = (row_id, 0)
-        yhist = get_pixel_distribution(w, h, ydata, calc_axis)
+        yhist = ystats.distro[calc_axis]
         image = plot_map_help(
-            yhist, plotsize, location, 1, 1, "Y (luma)", xlabel, "luma"
+            yhist, plotsize, location, 1, 1, "Y (luma)", xlabel, "luma", ymin
         )
         fig.colorbar(image)
         fig.set_facecolor("w")
@@ -271,18 +384,18 @@ def plot_map(source, name, options, ydata, udata, vdata, calc_axis):
     if not options.no_chroma:
         # print U
         location = (row_id, 0)
-        uhist = get_pixel_distribution(cw, ch, udata, calc_axis)
+        uhist = ustats.distro[calc_axis]
         image = plot_map_help(
-            uhist, plotsize, location, 1, 1, "Cb (U chroma)", xlabel, "Cb"
+            uhist, plotsize, location, 1, 1, "Cb (U chroma)", xlabel, "Cb", ymin
         )
         fig.colorbar(image)
         fig.set_facecolor("w")
         row_id += 1
         # print V
         location = (row_id, 0)
-        vhist = get_pixel_distribution(cw, ch, vdata, calc_axis)
+        vhist = vstats.distro[calc_axis]
         image = plot_map_help(
-            vhist, plotsize, location, 1, 1, "Cr (V chroma)", xlabel, "Cr"
+            vhist, plotsize, location, 1, 1, "Cr (V chroma)", xlabel, "Cr", ymin
         )
         fig.colorbar(image)
         fig.set_facecolor("w")
@@ -292,48 +405,568 @@ def plot_map(source, name, options, ydata, udata, vdata, calc_axis):
     plt.tight_layout()
     plt.subplots_adjust(top=0.85)
     fig.savefig("%s.map.%s.%s" % (source, orientation, IMAGE_EXT))
+    plt.close(fig)
+
+
+def plot_trend_help(trend, plane, color):
+    xdata = trend["frame"]
+    mean = trend["%s.mean" % plane]
+    std = trend["%s.std" % plane]
+    (line,) = plt.plot(xdata, mean, "-", color=color)
+    line.set_label("%s.avg" % plane.upper())
+    plt.plot(xdata, mean - std, linestyle="dotted", color=color)
+    plt.plot(xdata, mean + std, linestyle="dotted", color=color)
+    plt.fill_between(
+        xdata,
+        trend["%s.min" % plane],
+        trend["%s.max" % plane],
+        color=color,
+        alpha=0.1,
+    )
 
 
-def read_image(infile, w, h, frame_number, pix_fmt):
-    # get the full image
-    data = yuvcommon.read_image(infile, w, h, pix_fmt, frame_number)
-
-    # get luma and chroma (4:2:0) dimensions
-    ysize = int(w * h)
-    usize = ysize / 4
-    cw, ch = int(w / 2), int(h / 2)
-
-    # read the frame's luma
-    ydata = np.zeros((h, w))
-    for x in range(0, w):
-        for y in range(0, h):
-            val = data[w * y + x]
-            ydata[y][x] = val
-
-    # read the frame's chromas
-    udata = np.zeros((ch, cw))
-    vdata = np.zeros((ch, cw))
-    if pix_fmt == "yuv420p":
-        for y in range(0, ch):
-            for x in range(0, cw):
-                val = data[int(cw * y + x + ysize)]
-                udata[y][x] += val
-        for y in range(0, ch):
-            for x in range(0, cw):
-                val = data[int(cw * y + x + ysize + usize)]
-                vdata[y][x] += val
-
-    elif pix_fmt == "nv12":
-        for x in range(0, cw):
-            for y in range(0, ch):
-                val = data[w * y + x * 2 + ysize]
-                udata[y][x] += val
-                val = data[w * y + x * 2 + ysize + 1]
-                vdata[y][x] += val
+# plot the per-frame (or per-bucket) trend of luma and/or chromas: the mean
+# (solid), mean +/- stddev (dotted), and min..max (shaded) values, and the
+# number of out-of-range pixels
+def plot_trend(source, name, options, trend):
+    title = "%s (%s) Trend" % (name, source)
 
+    fig = plt.figure(num=title, figsize=options.figsize)
+
+    # get layout
+    rows = 1
+    if not options.no_luma:
+        rows += 1
+    if not options.no_chroma:
+        rows += 1
+    plotsize = (rows, 1)
+    row_id = 0
+    planes = []
+
+    # print luma
+    if not options.no_luma:
+        plt.subplot2grid(plotsize, (row_id, 0), 1, 1)
+        plot_trend_help(trend, "y", "0.5")
+        plt.grid()
+        plt.ylabel("Y (luma)", fontsize=FONTSIZE_SMALL)
+        plt.legend()
+        planes.append(("y", "0.5"))
+        row_id += 1
+
+    # print chromas
+    if not options.no_chroma:
+        plt.subplot2grid(plotsize, (row_id, 0), 1, 1)
+        plot_trend_help(trend, "u", "b")
+        plot_trend_help(trend, "v", "r")
+        plt.grid()
+        plt.ylabel("chroma", fontsize=FONTSIZE_SMALL)
+        plt.legend()
+        planes += [("u", "b"), ("v", "r")]
+        row_id += 1
+
+    # print the out-of-range pixels
+    plt.subplot2grid(plotsize, (row_id, 0), 1, 1)
+    for plane, color in planes:
+        (line,) = plt.plot(
+            trend["frame"],
+            trend["%s.below" % plane] + trend["%s.above" % plane],
+            "-",
+            color=color,
+        )
+        line.set_label("%s.out_of_range" % plane.upper())
+    plt.grid()
+    plt.xlabel("frame", fontsize=FONTSIZE_SMALL)
+    plt.ylabel("%s range pixels" % options.range, fontsize=FONTSIZE_SMALL)
+    plt.legend()
+    fig.set_facecolor("w")
+
+    fig.suptitle(title, fontsize=FONTSIZE_BIG)
+    plt.tight_layout()
+    plt.subplots_adjust(top=0.85)
+    fig.savefig("%s.trend.%s" % (source, IMAGE_EXT))
+    plt.close(fig)
+
+
+# plot the per-block heatmaps: one row per plane (luma and/or chromas),
+# and one column per block stat
+def plot_blocks(source, name, options, blocks):
+    title = "%s (%s) %s %ix%i Blocks" % (
+        name,
+        source,
+        ("diff(%s)" % options.diff) if options.diff is not None else "",
+        options.block_size,
+        options.block_size,
+    )
+
+    fig = plt.figure(num=title, figsize=options.figsize)
+
+    # get layout
+    planes = []
+    if not options.no_luma:
+        planes.append(("y", "Y (luma)"))
+    if not options.no_chroma:
+        planes += [("u", "Cb (U chroma)"), ("v", "Cr (V chroma)")]
+    stats = [stat for stat in BLOCK_STATS if "y.%s" % stat in blocks]
+    plotsize = (len(planes), len(stats))
+
+    for row_id, (plane, ylabel) in enumerate(planes):
+        for col_id, stat in enumerate(stats):
+            plt.subplot2grid(plotsize, (row_id, col_id), 1, 1)
+            image = plt.imshow(
+                blocks["%s.%s" % (plane, stat)],
+                aspect="auto",
+                interpolation="nearest",
+                cmap=plt.cm.pink.reversed(),
+            )
+            fig.colorbar(image)
+            plt.title("%s %s" % (plane.upper(), stat), fontsize=FONTSIZE_MEDIUM)
+            plt.xlabel("block column", fontsize=FONTSIZE_SMALL)
+            plt.ylabel(ylabel, fontsize=FONTSIZE_SMALL)
+    fig.set_facecolor("w")
+
+    fig.suptitle(title, fontsize=FONTSIZE_BIG)
+    plt.tight_layout()
+    plt.subplots_adjust(top=0.85)
+    fig.savefig("%s.blocks.%s" % (source, IMAGE_EXT))
+    plt.close(fig)
+
+
+# returns the frame's luma and chromas as zero-copy uint8 views of the
+# (memory-mapped) file. Planes must be promoted (e.g. to int16) before
+# any arithmetic that can overflow (e.g. diffs)
+def read_image(infile, w, h, frame_number, pix_fmt):
+    frame = yuvcommon.map_image(infile, w, h, pix_fmt, frame_number)
+    ydata, udata, vdata = yuvcommon.get_planes(frame, w, h, pix_fmt)
     return ydata, udata, vdata
 
 
+# get the data behind the hist, distro, or map plots, as a dictionary of
+# named numpy arrays
+def get_stats_data(options, ystats, ustats, vstats, dstats):
+    data = {}
+    if options.func in ("hist", "map"):
+        xdata = PIXEL_RANGE if options.diff is None else DIFF_PIXEL_RANGE
+        data["value"] = np.array(xdata)
+    if options.func == "hist":
+        for plane, stats in zip("yuv", (ystats, ustats, vstats)):
+            data[plane] = stats.hist
+        return data
+    for calc_axis, orientation in enumerate(("horizontal", "vertical")):
+        if options.func == "map":
+            # (value, position) arrays
+            for plane, stats in zip("yuv", (ystats, ustats, vstats)):
+                data["%s.%s" % (orientation, plane)] = stats.distro[calc_axis]
+        elif options.func == "distro":
+            for plane, stats in zip(
+                ("y", "u", "v", "uv"), (ystats, ustats, vstats, dstats)
+            ):
+                key = "%s.%s" % (orientation, plane)
+                data["%s.mean" % key] = stats.mean[calc_axis]
+                data["%s.std" % key] = stats.std(calc_axis)
+    return data
+
+
+# write the plot data. CSV files use a row per 1D array (or per row of a 2D
+# array), starting with the array name (and row index)
+def write_stats_data(outfile, data, data_format):
+    if data_format == "npz":
+        with open(outfile, "wb") as fout:
+            np.savez(fout, **data)
+        return
+    with open(outfile, "w") as fout:
+        if data_format == "json":
+            json.dump({key: val.tolist() for key, val in data.items()}, fout)
+            fout.write("\n")
+        elif data_format == "csv":
+            writer = csv.writer(fout)
+            for key, val in data.items():
+                if val.ndim == 1:
+                    writer.writerow([key] + val.tolist())
+                    continue
+                for i, row in enumerate(val):
+                    writer.writerow(["%s[%i]" % (key, i)] + row.tolist())
+
+
+# get the SSIM of 2 planes, using 8x8 windows with a stride of 4. Window
+# sums are obtained from 4x4 block sums (one reshape-and-reduce pass per
+# moment), so no per-pixel filtering is needed. Planes are cropped to a
+# multiple of 4, and planes smaller than 8x8 use a single window
+def get_ssim(xdata, ydata):
+    h, w = xdata.shape
+    x = xdata.astype(np.float64)
+    y = ydata.astype(np.float64)
+    moments = (x, y, x * x, y * y, x * y)
+    if h < 8 or w < 8:
+        num = h * w
+        sums = [m.sum() for m in moments]
+    else:
+        h, w = h // 4 * 4, w // 4 * 4
+        num = 64
+        sums = []
+        for m in moments:
+            block = m[:h, :w].reshape(h // 4, 4, w // 4, 4).sum(axis=(1, 3))
+            sums.append(
+                block[:-1, :-1] + block[1:, :-1] + block[:-1, 1:] + block[1:, 1:]
+            )
+    mx, my, mxx, myy, mxy = (s / num for s in sums)
+    varx = mxx - mx * mx
+    vary = myy - my * my
+    covxy = mxy - mx * my
+    ssim = ((2 * mx * my + SSIM_C1) * (2 * covxy + SSIM_C2)) / (
+        (mx * mx + my * my + SSIM_C1) * (varx + vary + SSIM_C2)
+    )
+    return float(np.mean(ssim))
+
+
+# get the quality metrics of a plane vs. its reference plane: PSNR, MSE,
+# max absolute error, SSIM, and the fraction of pixels whose absolute
+# error is over threshold
+def get_plane_metrics(data, ref_data, threshold):
+    diff = data.astype(np.int16) - ref_data
+    absdiff = np.abs(diff)
+    mse = float(np.mean(diff.astype(np.int32) ** 2))
+    psnr = float("inf") if mse == 0 else float(10 * np.log10(255 * 255 / mse))
+    return {
+        "psnr": psnr,
+        "mse": mse,
+        "maxabs": int(absdiff.max()),
+        "ssim": get_ssim(data, ref_data),
+        "over": float(np.count_nonzero(absdiff > threshold) / absdiff.size),
+    }
+
+
+# get the per-frame, per-plane metrics of a source vs. the --diff file.
+# Frames are streamed (one frame of each file in memory at a time)
+def get_source_metrics(options, source):
+    w, h = options.width, options.height
+    # only the frames present in both files are compared
+    frame_numbers = min(
+        (
+            get_frame_numbers(options, infile, "all")
+            for infile in (source, options.diff)
+        ),
+        key=len,
+    )
+    rows = []
+    for frame_number in frame_numbers:
+        planes = read_image(source, w, h, frame_number, options.pix_fmt)
+        ref_planes = read_image(options.diff, w, h, frame_number, options.pix_fmt)
+        for plane, data, ref_data in zip("yuv", planes, ref_planes):
+            row = {"frame": frame_number, "plane": plane}
+            row.update(get_plane_metrics(data, ref_data, options.threshold))
+            rows.append(row)
+    return rows
+
+
+# get the summary (mean and percentiles) of each metric, per plane
+def get_metrics_summary(rows):
+    summary = {}
+    for plane in "yuv":
+        summary[plane] = {}
+        for metric in METRICS:
+            vals = np.array([row[metric] for row in rows if row["plane"] == plane])
+            if vals.size == 0:
+                continue
+            # avoid interpolating between infinite values (lossless PSNR)
+            percentiles = np.percentile(vals, SUMMARY_PERCENTILES, method="nearest")
+            summary[plane][metric] = {"mean": float(vals.mean())}
+            for q, val in zip(SUMMARY_PERCENTILES, percentiles):
+                summary[plane][metric]["p%i" % q] = float(val)
+    return summary
+
+
+# get a JSON-compatible copy of the metrics. JSON has no infinity, so
+# infinite values (the PSNR of lossless frames) are written as null
+def get_json_metrics(val):
+    if isinstance(val, dict):
+        return {key: get_json_metrics(v) for key, v in val.items()}
+    elif isinstance(val, list):
+        return [get_json_metrics(v) for v in val]
+    elif isinstance(val, float) and np.isinf(val):
+        return None
+    return val
+
+
+# write the per-frame metrics and their summary. JSON files contain both,
+# while CSV files contain the per-frame metrics, and the summary is written
+# to a "<outfile base>.summary.csv" file next to them
+def write_metrics(outfile, rows, summary, metrics_format):
+    if metrics_format == "json":
+        with open(outfile, "w") as fout:
+            json.dump(
+                get_json_metrics({"frames": rows, "summary": summary}),
+                fout,
+                indent=2,
+                allow_nan=False,
+            )
+            fout.write("\n")
+    elif metrics_format == "csv":
+        with open(outfile, "w") as fout:
+            writer = csv.DictWriter(fout, fieldnames=["frame", "plane"] + list(METRICS))
+            writer.writeheader()
+            writer.writerows(rows)
+        summary_outfile = "%s.summary.csv" % os.path.splitext(outfile)[0]
+        with open(summary_outfile, "w") as fout:
+            fieldnames = ["plane", "metric", "mean"]
+            fieldnames += ["p%i" % q for q in SUMMARY_PERCENTILES]
+            writer = csv.DictWriter(fout, fieldnames=fieldnames)
+            writer.writeheader()
+            for plane, plane_summary in summary.items():
+                for metric, vals in plane_summary.items():
+                    writer.writerow({"plane": plane, "metric": metric, **vals})
+
+
+def print_metrics_summary(source, summary):
+    for plane, plane_summary in summary.items():
+        for metric, vals in plane_summary.items():
+            print(
+                "%s %s %s %s"
+                % (
+                    source,
+                    plane,
+                    metric,
+                    " ".join("%s: %f" % (key, val) for key, val in vals.items()),
+                )
+            )
+
+
+# get the per-frame trend stats (mean, std, min, max, and number of pixels
+# below/above the --range bounds) of the Y, U, and V planes of the
+# frame_numbers frames of a source, as a dictionary of (num_frames,)
+# arrays. The stats of each frame are derived from its plane histograms,
+# so each frame is read once
+def get_trend_stats(options, source, frame_numbers):
+    w, h = options.width, options.height
+    video = yuvcommon.map_video(source, w, h, options.pix_fmt)
+    bounds = yuvcommon.yuv_range[options.range]
+    vmin = np.array([bounds["%smin" % plane] for plane in "yuv"])
+    vmax = np.array([bounds["%smax" % plane] for plane in "yuv"])
+    values = np.arange(256)
+    below = values < vmin[:, np.newaxis]
+    above = values > vmax[:, np.newaxis]
+    stats = np.zeros((len(frame_numbers), 3, len(TREND_STATS)))
+    for i, frame_number in enumerate(frame_numbers):
+        planes = yuvcommon.get_planes(video[frame_number], w, h, options.pix_fmt)
+        hists = np.array([np.bincount(data.ravel(), minlength=256) for data in planes])
+        num = hists.sum(axis=1)
+        mean = hists @ values / num
+        nonzero = hists > 0
+        stats[i] = np.stack(
+            (
+                mean,
+                np.sqrt(np.maximum(hists @ values**2 / num - mean**2, 0)),
+                nonzero.argmax(axis=1),
+                255 - nonzero[:, ::-1].argmax(axis=1),
+                (hists * below).sum(axis=1),
+                (hists * above).sum(axis=1),
+            ),
+            axis=1,
+        )
+    trend = {"frame": np.array(frame_numbers, dtype=np.int64)}
+    for plane_id, plane in enumerate("yuv"):
+        for stat_id, stat in enumerate(TREND_STATS):
+            trend["%s.%s" % (plane, stat)] = stats[:, plane_id, stat_id]
+    return trend
+
+
+# the trend cache is only valid for the same source file (size and mtime),
+# geometry, pixel format, and range
+def get_trend_cache_key(options, source):
+    st = os.stat(source)
+    return "v%i:%i:%i:%ix%i:%s:%s" % (
+        TREND_CACHE_VERSION,
+        st.st_size,
+        st.st_mtime_ns,
+        options.width,
+        options.height,
+        options.pix_fmt,
+        options.range,
+    )
+
+
+# get the per-frame trend stats of the frame_numbers frames of a source,
+# from the "<source>.trend.cache.npz" cache file when it is valid (so
+# re-plotting does not re-read the video). The cache holds the stats of
+# all the frames, so it is only written by runs that select all the
+# frames: other runs only read the frames they select
+def get_trend_stats_cached(options, source, frame_numbers):
+    cache_path = "%s.trend.cache.npz" % source
+    key = get_trend_cache_key(options, source)
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cache:
+            if str(cache["key"]) == key:
+                index = np.array(frame_numbers, dtype=np.int64)
+                return {
+                    name: cache[name][index] for name in cache.files if name != "key"
+                }
+    trend = get_trend_stats(options, source, frame_numbers)
+    num_frames = len(
+        yuvcommon.map_video(source, options.width, options.height, options.pix_fmt)
+    )
+    if frame_numbers != range(num_frames):
+        return trend
+    # store it atomically (an unwritable cache dir is not an error)
+    try:
+        with yuvcommon.atomic_write(cache_path) as fout:
+            np.savez(fout, key=np.array(key), **trend)
+    except OSError:
+        pass
+    return trend
+
+
+# get the per-frame trend stats of the --frames range (all the frames by
+# default) of a source
+def get_source_trend(options, source):
+    frame_numbers = get_frame_numbers(options, source, "all")
+    return get_trend_stats_cached(options, source, frame_numbers)
+
+
+# bin the per-frame trend stats into (at most) num_buckets buckets of
+# consecutive frames. Buckets keep the first frame number, the mean and
+# (pooled) stddev, the min of the mins, and the max of the others
+def get_trend_buckets(trend, num_buckets):
+    num_frames = len(trend["frame"])
+    if num_frames <= num_buckets:
+        return trend
+    starts = np.linspace(0, num_frames, num_buckets, endpoint=False).astype(int)
+    sizes = np.diff(np.append(starts, num_frames))
+    buckets = {"frame": trend["frame"][starts]}
+    for plane in "yuv":
+        mean = trend["%s.mean" % plane]
+        std = trend["%s.std" % plane]
+        bucket_mean = np.add.reduceat(mean, starts) / sizes
+        bucket_m2 = np.add.reduceat(std**2 + mean**2, starts) / sizes
+        buckets["%s.mean" % plane] = bucket_mean
+        buckets["%s.std" % plane] = np.sqrt(np.maximum(bucket_m2 - bucket_mean**2, 0))
+        buckets["%s.min" % plane] = np.minimum.reduceat(trend["%s.min" % plane], starts)
+        for stat in ("max", "below", "above"):
+            buckets["%s.%s" % (plane, stat)] = np.maximum.reduceat(
+                trend["%s.%s" % (plane, stat)], starts
+            )
+    return buckets
+
+
+# get the per-block sums of a plane, using a reshape-and-reduce. Planes
+# are zero-padded to a multiple of the block size
+def get_block_sums(data, block_size):
+    h, w = data.shape
+    bh, bw = -(-h // block_size), -(-w // block_size)
+    if (bh * block_size, bw * block_size) != (h, w):
+        data = np.pad(data, ((0, bh * block_size - h), (0, bw * block_size - w)))
+    return data.reshape(bh, block_size, bw, block_size).sum(axis=(1, 3), dtype=np.int64)
+
+
+# get the number of (non-padding) pixels of each block of a plane
+def get_block_counts(h, w, block_size):
+    rows = np.minimum(block_size, h - np.arange(0, h, block_size))
+    cols = np.minimum(block_size, w - np.arange(0, w, block_size))
+    return np.outer(rows, cols)
+
+
+# get the per-block mean, variance, and (with --diff) diff energy (mean
+# squared diff vs. the --diff file) of the Y, U, and V planes
+# of a source, as a dictionary of (block rows, block columns) arrays.
+# Blocks are --block_size samples of each plane, and stats are
+# accumulated over the --frames range
+def get_source_blocks(options, source):
+    w, h = options.width, options.height
+    block_size = options.block_size
+    sums = {}
+    num_frames = 0
+    for frame_number in get_frame_numbers(options, source):
+        planes = read_image(source, w, h, frame_number, options.pix_fmt)
+        if options.diff is not None:
+            ref_planes = read_image(options.diff, w, h, frame_number, options.pix_fmt)
+        for plane_id, plane in enumerate("yuv"):
+            data = planes[plane_id].astype(np.int32)
+            plane_sums = [get_block_sums(data, block_size)]
+            plane_sums.append(get_block_sums(data * data, block_size))
+            if options.diff is not None:
+                diff = data - ref_planes[plane_id]
+                plane_sums.append(get_block_sums(diff * diff, block_size))
+            if plane not in sums:
+                sums[plane] = plane_sums
+            else:
+                sums[plane] = [a + b for a, b in zip(sums[plane], plane_sums)]
+        num_frames += 1
+    # plane sizes (rows, columns)
+    sx, sy = yuvcommon.get_chroma_subsampling(options.pix_fmt)
+    shapes = ((h, w), (h // sy, w // sx), (h // sy, w // sx))
+    blocks = {}
+    for plane, shape in zip("yuv", shapes):
+        counts = get_block_counts(*shape, block_size) * num_frames
+        mean = sums[plane][0] / counts
+        blocks["%s.mean" % plane] = mean
+        blocks["%s.var" % plane] = np.maximum(sums[plane][1] / counts - mean**2, 0)
+        if options.diff is not None:
+            blocks["%s.energy" % plane] = sums[plane][2] / counts
+    return blocks
+
+
+# get the census of the out-of-range samples of each frame of a source:
+# a (frame, plane) row with the number of samples below and above the
+# --range bounds (as in yuvcommon.yuv_range), the number of samples clipped
+# at 0 and 255, and the (x, y) coordinates of the first out-of-range
+# sample (None if there is none). Counts are derived from the plane
+# histograms, so in-range planes are only read once
+def get_source_census(options, source):
+    w, h = options.width, options.height
+    bounds = yuvcommon.yuv_range[options.range]
+    video = yuvcommon.map_video(source, w, h, options.pix_fmt)
+    rows = []
+    for frame_number in get_frame_numbers(options, source, "all"):
+        planes = yuvcommon.get_planes(video[frame_number], w, h, options.pix_fmt)
+        for plane, data in zip("yuv", planes):
+            vmin, vmax = bounds["%smin" % plane], bounds["%smax" % plane]
+            hist = np.bincount(data.ravel(), minlength=256)
+            row = {
+                "frame": frame_number,
+                "plane": plane,
+                "below": int(hist[:vmin].sum()),
+                "above": int(hist[vmax + 1 :].sum()),
+                "clipped0": int(hist[0]),
+                "clipped255": int(hist[255]),
+                "first": None,
+            }
+            if row["below"] or row["above"]:
+                index = np.argmax((data < vmin) | (data > vmax))
+                y, x = np.unravel_index(index, data.shape)
+                row["first"] = (int(x), int(y))
+            rows.append(row)
+    return rows
+
+
+# print the census of a source (the per-frame totals of the frames with
+# out-of-range samples), and return the number of such frames
+def print_census(source, options, rows):
+    bad_frames = set()
+    for row in rows:
+        if row["first"] is None:
+            continue
+        bad_frames.add(row["frame"])
+        if options.debug >= 0:
+            print(
+                "%s frame: %i plane: %s below: %i above: %i clipped0: %i "
+                "clipped255: %i first: (%i, %i)"
+                % (
+                    source,
+                    row["frame"],
+                    row["plane"],
+                    row["below"],
+                    row["above"],
+                    row["clipped0"],
+                    row["clipped255"],
+                    *row["first"],
+                )
+            )
+    if options.debug >= 0:
+        print(
+            "%s: %i/%i frames out of %s range"
+            % (source, len(bad_frames), len(rows) // 3, options.range)
+        )
+    return len(bad_frames)
+
+
 def get_options(argv):
     parser = argparse.ArgumentParser()
     # debug info
@@ -396,6 +1029,17 @@ def get_options(argv):
     parser.add_argument(
         "-n", "--frame_number", required=False, help="frame number", type=int, default=0
     )
+    parser.add_argument(
+        "--frames",
+        action="store",
+        type=str,
+        dest="frames",
+        default=None,
+        metavar="[all | START:END[:STEP]]",
+        help="aggregate the statistics of a range of frames "
+        "(overrides --frame_number)",
+    )
+    yuvcommon.add_jobs_argument(parser, 1, "multi-source processing")
     parser.add_argument(
         "--no_luma",
         required=False,
@@ -424,6 +1068,19 @@ def get_options(argv):
     parser.add_argument(
         "--figsize", help="Size of figure (WxH), in inches", type=str, default="10x8"
     )
+    parser.add_argument(
+        "--format",
+        action="store",
+        type=str,
+        dest="format",
+        default=None,
+        choices=DATA_FORMATS,
+        metavar="FORMAT",
+        help=(
+            "export the plot data as %r instead of plotting it (metrics: "
+            "output format %r, default: csv)" % (DATA_FORMATS, METRICS_FORMATS)
+        ),
+    )
 
     # add sub-command parsers
     subparsers = parser.add_subparsers()
@@ -433,9 +1090,70 @@ def get_options(argv):
     parser_distro.set_defaults(func="distro")
     parser_map = subparsers.add_parser("map", help="create a pixel map")
     parser_map.set_defaults(func="map")
+    parser_metrics = subparsers.add_parser(
+        "metrics", help="get per-frame quality metrics vs. the --diff file"
+    )
+    parser_metrics.set_defaults(func="metrics")
+    parser_metrics.add_argument(
+        "--threshold",
+        action="store",
+        type=int,
+        dest="threshold",
+        default=2,
+        metavar="THRESHOLD",
+        help="count pixels whose absolute error is over THRESHOLD",
+    )
+
+    parser_trend = subparsers.add_parser(
+        "trend", help="plot the per-frame stats of long captures"
+    )
+    parser_trend.set_defaults(func="trend", diff=None)
+    parser_trend.add_argument(
+        "--buckets",
+        action="store",
+        type=int,
+        dest="buckets",
+        default=1000,
+        metavar="BUCKETS",
+        help="plot at most BUCKETS points (by binning consecutive frames)",
+    )
+    parser_census = subparsers.add_parser(
+        "census", help="count the out-of-range and clipped samples (fails if any)"
+    )
+    parser_census.set_defaults(func="census", diff=None)
+
+    # single-file input files
+    for p in (parser_trend, parser_census):
+        p.add_argument(
+            "--range",
+            action="store",
+            type=str,
+            dest="range",
+            default="limited",
+            choices=yuvcommon.RANGE_LIST,
+            metavar="[%s]" % (" | ".join(yuvcommon.RANGE_LIST)),
+            help="count the pixels out of the RANGE bounds (default: limited)",
+        )
+        p.add_argument(
+            "source", nargs="+", help="source/name list, separated with spaces"
+        )
+
+    parser_blocks = subparsers.add_parser(
+        "blocks", help="create per-block mean, variance, and diff energy maps"
+    )
+    parser_blocks.set_defaults(func="blocks")
+    parser_blocks.add_argument(
+        "--block_size",
+        action="store",
+        type=int,
+        dest="block_size",
+        default=16,
+        metavar="BLOCK_SIZE",
+        help="use BLOCK_SIZExBLOCK_SIZE blocks (in samples of each plane)",
+    )
 
     # input files
-    for p in (parser_hist, parser_map, parser_distro):
+    for p in (parser_hist, parser_map, parser_distro, parser_metrics, parser_blocks):
         p.add_argument(
             "source", nargs="+", help="source/name list, separated with spaces"
         )
@@ -446,6 +1164,7 @@ def get_options(argv):
     options = parser.parse_args(argv[1:])
 
     # post-processing
+    options.jobs = yuvcommon.get_num_jobs(options.jobs)
     options.figsize = (
         None
         if options.figsize is None
@@ -465,51 +1184,184 @@ def get_options(argv):
                 parser.print_usage()
                 sys.exit(-1)
             options.source_dict[last_source] = item
+    # metrics compare each source to the --diff file
+    if options.func == "metrics" and options.diff is None:
+        parser.print_usage()
+        sys.exit(-1)
+    # metrics are always written to a file (csv by default), and census
+    # only prints its results
+    if options.func == "metrics":
+        if options.format is None:
+            options.format = "csv"
+        if options.format not in METRICS_FORMATS:
+            parser_metrics.error("unsupported --format: %s" % options.format)
+    if options.func == "census" and options.format is not None:
+        parser_census.error("--format is not supported")
+    if options.func == "blocks" and options.block_size < 1:
+        parser_blocks.error("invalid block size: %i" % options.block_size)
 
     return options
 
 
-def process_options(options):
-    # parse parameters
-    w, h = options.width, options.height
-
-    if options.diff is not None:
-        s_ydata, s_udata, s_vdata = read_image(
-            options.diff, w, h, options.frame_number, options.pix_fmt
+# get the frame numbers to process (--frames, or --frame_number). Commands
+# that process whole videos use a default_frames range (e.g. "all") when
+# --frames is not set
+def get_frame_numbers(options, infile, default_frames=None):
+    frames = default_frames if options.frames is None else options.frames
+    if frames is None:
+        return [options.frame_number]
+    start, end, step = yuvcommon.parse_frame_range(frames)
+    num_frames = len(
+        yuvcommon.map_video(infile, options.width, options.height, options.pix_fmt)
+    )
+    end = num_frames if end is None else min(end, num_frames)
+    frame_numbers = range(start, end, step)
+    if len(frame_numbers) == 0:
+        print(
+            "error: empty frame range: %s (%s has %i frames)"
+            % (frames, infile, num_frames)
         )
+        sys.exit(-1)
+    return frame_numbers
 
-    for source, name in options.source_dict.items():
-        if options.debug > 0:
-            print('processing file: "%s" name: "%s"' % (source, name))
 
+# get the streaming statistics of the Y, U, V, and U-V planes of a source
+# (diffed against the same frame of the --diff file)
+def get_source_stats(options, source):
+    w, h = options.width, options.height
+    not_a_diff = options.diff is None
+    stats = [PlaneStats(options.func, not_a_diff) for _ in range(4)]
+    for frame_number in get_frame_numbers(options, source):
         # read input image
-        ydata, udata, vdata = read_image(
-            source, w, h, options.frame_number, options.pix_fmt
-        )
+        ydata, udata, vdata = read_image(source, w, h, frame_number, options.pix_fmt)
         if options.diff is not None:
-            ydata = ydata - s_ydata
-            udata = udata - s_udata
-            vdata = vdata - s_vdata
+            s_ydata, s_udata, s_vdata = read_image(
+                options.diff, w, h, frame_number, options.pix_fmt
+            )
+            ydata = ydata.astype(np.int16) - s_ydata
+            udata = udata.astype(np.int16) - s_udata
+            vdata = vdata.astype(np.int16) - s_vdata
+        planes = [ydata, udata, vdata]
+        if options.func == "distro":
+            planes.append(udata.astype(np.int16) - vdata)
+        for plane_stats, data in zip(stats, planes):
+            plane_stats.update(data)
+    return stats
+
+
+# get the statistics (or metrics) of a source
+def get_source_results(options, source):
+    if options.func == "metrics":
+        return get_source_metrics(options, source)
+    elif options.func == "trend":
+        return get_source_trend(options, source)
+    elif options.func == "blocks":
+        return get_source_blocks(options, source)
+    elif options.func == "census":
+        return get_source_census(options, source)
+    return get_source_stats(options, source)
+
+
+# get the statistics (or metrics) of each source, as (source, results)
+# tuples. With --jobs, sources are processed by a process pool, and tuples
+# are returned as soon as each source completes. Workers memory-map the
+# input (and --diff) files, so the pages of the common reference are
+# shared (through the page cache) instead of being copied to each worker
+def get_sources_results(options):
+    if options.jobs <= 1 or len(options.source_dict) <= 1:
+        for source in options.source_dict:
+            yield source, get_source_results(options, source)
+        return
+    for (_, source), results in yuvcommon.run_in_pool(
+        options.jobs,
+        get_source_results,
+        [(options, source) for source in options.source_dict],
+    ):
+        yield source, results
+
+
+def process_options(options):
+    bad_frames = 0
+    for source, results in get_sources_results(options):
+        name = options.source_dict[source]
+        if options.debug > 0:
+            print('processing file: "%s" name: "%s"' % (source, name))
 
+        if options.func == "metrics":
+            rows = results
+            summary = get_metrics_summary(rows)
+            outfile = "%s.metrics.%s" % (source, options.format)
+            write_metrics(outfile, rows, summary, options.format)
+            if options.debug >= 0:
+                print_metrics_summary(source, summary)
+            continue
+
+        if options.func == "census":
+            bad_frames += print_census(source, options, results)
+            continue
+
+        if options.func == "blocks":
+            blocks = results
+            if options.format is not None:
+                outfile = "%s.blocks.%s" % (source, options.format)
+                write_stats_data(outfile, blocks, options.format)
+            else:
+                import_matplotlib()
+                plot_blocks(source, name, options, blocks)
+            continue
+
+        if options.func == "trend":
+            trend = results
+            if options.format is not None:
+                outfile = "%s.trend.%s" % (source, options.format)
+                write_stats_data(outfile, trend, options.format)
+            else:
+                import_matplotlib()
+                plot_trend(
+                    source, name, options, get_trend_buckets(trend, options.buckets)
+                )
+            continue
+
+        ystats, ustats, vstats, dstats = results
+
+        if options.format is not None:
+            data = get_stats_data(options, ystats, ustats, vstats, dstats)
+            outfile = "%s.%s.%s" % (source, options.func, options.format)
+            write_stats_data(outfile, data, options.format)
+            continue
+
+        import_matplotlib()
         if options.func == "hist":
-            plot_histogram(source, name, options, ydata, udata, vdata)
+            plot_histogram(source, name, options, ystats, ustats, vstats)
 
         elif options.func == "distro":
             # horizontal plot
-            figh = plot_distribution(source, name, options, ydata, udata, vdata, 0)
+            figh = plot_distribution(
+                source, name, options, ystats, ustats, vstats, dstats, 0
+            )
             # vertical plot
-            figv = plot_distribution(source, name, options, ydata, udata, vdata, 1)
+            figv = plot_distribution(
+                source, name, options, ystats, ustats, vstats, dstats, 1
+            )
 
         elif options.func == "map":
             # horizontal plot
-            plot_map(source, name, options, ydata, udata, vdata, 0)
+            plot_map(source, name, options, ystats, ustats, vstats, 0)
             # vertical plot
-            plot_map(source, name, options, ydata, udata, vdata, 1)
+            plot_map(source, name, options, ystats, ustats, vstats, 1)
 
-    if options.func == "distro":
-        # save the distro plots
+    if options.func == "distro" and options.format is None:
+        # save the distro plots (named after the last source, as sources
+        # may complete out of order with --jobs)
+        source = list(options.source_dict)[-1]
         figh.savefig("%s.distro.%s.%s" % (source, "horizontal", IMAGE_EXT))
         figv.savefig("%s.distro.%s.%s" % (source, "vertical", IMAGE_EXT))
+        plt.close(figh)
+        plt.close(figv)
+
+    # fail if the census found any out-of-range sample
+    if bad_frames > 0:
+        sys.exit(-1)
 
     # XXX(chema)
     # if options.image is None:
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+
+"""yuvplot unittest usage."""
+
+# http://www.voidspace.org.uk/python/articles/introduction-to-unittest.shtml
+
+import contextlib
+import io
+import json
+import numpy as np
+import os
+import tempfile
+import unittest
+
+import yuvplot
+
+
+class YuvPlotTestCase(unittest.TestCase):
+    def testPixelHistogram(self):
+        """Test the histograms against a per-pixel count"""
+        rng = np.random.default_rng(0)
+        ydata = rng.integers(0, 256, (8, 16)).astype(np.uint8)
+        udata = rng.integers(0, 256, (4, 8)).astype(np.uint8)
+        vdata = rng.integers(0, 256, (4, 8)).astype(np.uint8)
+        # (plane) values and diffs (including the range limits)
+        diff = ydata.astype(np.int16) - udata.repeat(2, 0).repeat(2, 1)
+        diff[0, 0], diff[0, 1] = -255, 255
+        for planes, not_a_diff in (
+            ((ydata, udata, vdata), True),
+            ((ydata.astype(np.float64),), True),
+            ((diff, diff.astype(np.float64)), False),
+        ):
+            xdata, hists = yuvplot.get_pixel_histograms(planes, not_a_diff)
+            for data, hist in zip(planes, hists):
+                expected = [0] * len(xdata)
+                for val in data.ravel():
+                    expected[xdata.index(int(val))] += 1
+                self.assertEqual(expected, list(hist))
+        # single-plane version
+        xdata, hist = yuvplot.get_pixel_histogram(16, 8, ydata, True)
+        self.assertEqual(list(xdata), list(range(256)))
+        self.assertEqual(16 * 8, sum(hist))
+
+    def testPixelDistribution(self):
+        """Test the distribution maps against a per-pixel count"""
+        rng = np.random.default_rng(0)
+        ydata = rng.integers(0, 256, (8, 16)).astype(np.uint8)
+        diff = ydata.astype(np.int16) - rng.integers(0, 256, (8, 16))
+        diff[0, 0], diff[0, 1] = -255, 255
+        for data, not_a_diff in ((ydata, True), (diff, False)):
+            yrange = yuvplot.PIXEL_RANGE if not_a_diff else yuvplot.DIFF_PIXEL_RANGE
+            for calc_axis in (0, 1):
+                distro = yuvplot.get_pixel_distribution(
+                    16, 8, data, calc_axis, not_a_diff
+                )
+                expected = np.zeros((len(yrange), 16 if calc_axis == 0 else 8))
+                for y in range(8):
+                    for x in range(16):
+                        val = yrange.index(int(data[y][x]))
+                        expected[val][x if calc_axis == 0 else y] += 1
+                self.assertEqual(np.int64, distro.dtype)
+                np.testing.assert_array_equal(expected, distro)
+
+    def testReadImage(self):
+        """Test that read_image returns uint8 plane views"""
+        width, height = 16, 8
+        frame = np.arange(width * height * 3 // 2, dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            with open(infile, "wb") as fout:
+                fout.write(bytes(width * height * 3 // 2) + frame.tobytes())
+            for pix_fmt, expected_u, expected_v in (
+                ("yuv420p", frame[128:160], frame[160:192]),
+                ("nv12", frame[128:192:2], frame[129:192:2]),
+            ):
+                ydata, udata, vdata = yuvplot.read_image(
+                    infile, width, height, 1, pix_fmt
+                )
+                for data, expected, shape in (
+                    (ydata, frame[:128], (height, width)),
+                    (udata, expected_u, (height // 2, width // 2)),
+                    (vdata, expected_v, (height // 2, width // 2)),
+                ):
+                    self.assertEqual(np.uint8, data.dtype)
+                    self.assertFalse(data.flags.owndata)
+                    np.testing.assert_array_equal(expected.reshape(shape), data)
+
+    def testPlaneStats(self):
+        """Test that streaming statistics match the all-frames statistics"""
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 256, (8, 16)).astype(np.uint8) for _ in range(5)]
+        video = np.concatenate(frames)
+        stats = {}
+        for func in ("hist", "map", "distro"):
+            stats[func] = yuvplot.PlaneStats(func, True)
+            for data in frames:
+                stats[func].update(data)
+        self.assertEqual(5, stats["hist"].num_frames)
+        self.assertEqual(video.min(), stats["hist"].min)
+        self.assertEqual(video.max(), stats["hist"].max)
+        _, (hist,) = yuvplot.get_pixel_histograms([video], True)
+        np.testing.assert_array_equal(hist, stats["hist"].hist)
+        # per-column maps and statistics
+        np.testing.assert_array_equal(
+            yuvplot.get_pixel_distribution(16, 40, video, 0),
+            stats["map"].distro[0],
+        )
+        np.testing.assert_allclose(video.mean(axis=0), stats["distro"].mean[0])
+        np.testing.assert_allclose(video.std(axis=0), stats["distro"].std(0))
+        # per-row statistics
+        rows = np.stack(frames).transpose(1, 0, 2).reshape(8, -1)
+        np.testing.assert_allclose(rows.mean(axis=1), stats["distro"].mean[1])
+        np.testing.assert_allclose(rows.std(axis=1), stats["distro"].std(1))
+
+    def testEmptyFrameRange(self):
+        """Test that an empty --frames range is rejected"""
+        frames = np.zeros(2 * 16 * 8 * 3 // 2, dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            frames.tofile(infile)
+            for func in ("hist", "distro", "blocks"):
+                options = yuvplot.get_options(
+                    ["yuvplot.py", "--video_size", "16x8", "--frames", "5:"]
+                    + ["--format", "json", func, infile]
+                )
+                with self.assertRaises(SystemExit), contextlib.redirect_stdout(
+                    io.StringIO()
+                ):
+                    yuvplot.process_options(options)
+
+    def testPlaneMetrics(self):
+        """Test the quality metrics against per-window/per-pixel versions"""
+        rng = np.random.default_rng(0)
+        ref = rng.integers(0, 256, (18, 21)).astype(np.uint8)
+        data = np.clip(ref + rng.integers(-5, 6, ref.shape), 0, 255).astype(np.uint8)
+        metrics = yuvplot.get_plane_metrics(data, ref, 2)
+        diff = data.astype(np.float64) - ref
+        self.assertAlmostEqual(np.mean(diff**2), metrics["mse"])
+        self.assertAlmostEqual(
+            10 * np.log10(255**2 / np.mean(diff**2)), metrics["psnr"]
+        )
+        self.assertEqual(np.abs(diff).max(), metrics["maxabs"])
+        self.assertAlmostEqual(np.mean(np.abs(diff) > 2), metrics["over"])
+        # 8x8 windows with a stride of 4 (cropped to 16x20)
+        ssims = []
+        for y in range(0, 16 - 4, 4):
+            for x in range(0, 20 - 4, 4):
+                a = ref[y : y + 8, x : x + 8].astype(np.float64)
+                b = data[y : y + 8, x : x + 8].astype(np.float64)
+                cov = np.mean(a * b) - a.mean() * b.mean()
+                ssims.append(
+                    (2 * a.mean() * b.mean() + yuvplot.SSIM_C1)
+                    * (2 * cov + yuvplot.SSIM_C2)
+                    / (
+                        (a.mean() ** 2 + b.mean() ** 2 + yuvplot.SSIM_C1)
+                        * (a.var() + b.var() + yuvplot.SSIM_C2)
+                    )
+                )
+        self.assertAlmostEqual(np.mean(ssims), metrics["ssim"])
+        # identical planes (including planes smaller than a window)
+        for plane in (ref, ref[:4, :6]):
+            metrics = yuvplot.get_plane_metrics(plane, plane, 0)
+            self.assertEqual(float("inf"), metrics["psnr"])
+            self.assertEqual(0, metrics["maxabs"])
+            self.assertAlmostEqual(1.0, metrics["ssim"])
+            self.assertEqual(0.0, metrics["over"])
+
+    def testMetricsOutput(self):
+        """Test the metrics and summary output files"""
+        rng = np.random.default_rng(0)
+        frames = rng.integers(0, 256, (2, 16 * 8 * 3 // 2)).astype(np.uint8)
+        # the second frame is lossless (infinite PSNR)
+        ref = frames.copy()
+        ref[0, :128] ^= 1
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            reffile = os.path.join(tmpdir, "ref.yuv")
+            # the source has an extra frame
+            np.concatenate((frames, frames[:1])).tofile(infile)
+            ref.tofile(reffile)
+            for metrics_format in yuvplot.METRICS_FORMATS:
+                options = yuvplot.get_options(
+                    ["yuvplot.py", "--quiet", "--video_size", "16x8"]
+                    + ["--format", metrics_format, "metrics"]
+                    + [infile, "--diff", reffile]
+                )
+                yuvplot.process_options(options)
+            # metrics are written as csv by default, and cannot use npz
+            options = yuvplot.get_options(
+                ["yuvplot.py", "metrics", infile, "--diff", reffile]
+            )
+            self.assertEqual("csv", options.format)
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(
+                io.StringIO()
+            ):
+                yuvplot.get_options(
+                    ["yuvplot.py", "--format", "npz", "metrics", infile]
+                    + ["--diff", reffile]
+                )
+            with open("%s.metrics.json" % infile) as fin:
+                data = json.load(fin)
+            # only the frames present in both files are compared
+            self.assertEqual(6, len(data["frames"]))
+            self.assertIsNone(data["frames"][3]["psnr"])
+            self.assertAlmostEqual(10 * np.log10(255 * 255), data["frames"][0]["psnr"])
+            self.assertIsNone(data["summary"]["y"]["psnr"]["p100"])
+            with open("%s.metrics.summary.csv" % infile) as fin:
+                lines = fin.read().splitlines()
+            self.assertEqual("plane,metric,mean,p0,p5,p50,p95,p100", lines[0])
+            self.assertEqual(1 + 3 * len(yuvplot.METRICS), len(lines))
+
+    def testStatsDataExport(self):
+        """Test that --format exports the plot data without plotting"""
+        rng = np.random.default_rng(0)
+        frame = rng.integers(0, 256, 16 * 8 * 3 // 2).astype(np.uint8)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            frame.tofile(infile)
+            for func, data_format in (
+                ("hist", "json"),
+                ("hist", "npz"),
+                ("distro", "npz"),
+                ("map", "csv"),
+            ):
+                options = yuvplot.get_options(
+                    ["yuvplot.py", "--video_size", "16x8", "--format", data_format]
+                    + [func, infile]
+                )
+                yuvplot.process_options(options)
+                outfile = "%s.%s.%s" % (infile, func, data_format)
+                if data_format == "json":
+                    with open(outfile) as fin:
+                        data = json.load(fin)
+                elif data_format == "npz":
+                    data = dict(np.load(outfile))
+                elif data_format == "csv":
+                    with open(outfile) as fin:
+                        data = {
+                            line.split(",")[0]: [int(v) for v in line.split(",")[1:]]
+                            for line in fin
+                        }
+                ydata = frame[:128].reshape(8, 16)
+                if func == "hist":
+                    expected = np.bincount(ydata.ravel(), minlength=256)
+                    np.testing.assert_array_equal(expected, data["y"])
+                elif func == "distro":
+                    np.testing.assert_allclose(
+                        ydata.std(axis=1), data["vertical.y.std"]
+                    )
+                elif func == "map":
+                    expected = yuvplot.get_pixel_distribution(16, 8, ydata, 0)
+                    np.testing.assert_array_equal(
+                        expected[200], data["horizontal.y[200]"]
+                    )
+        # matplotlib is only imported when plotting
+        self.assertIsNone(yuvplot.plt)
+
+    def testParallelSources(self):
+        """Test that --jobs produces the same results as serial processing"""
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infiles = [os.path.join(tmpdir, "input%i.yuv" % i) for i in range(4)]
+            for infile in infiles:
+                rng.integers(0, 256, 3 * 16 * 8 * 3 // 2).astype(np.uint8).tofile(
+                    infile
+                )
+            results = {}
+            for jobs in (1, 2):
+                options = yuvplot.get_options(
+                    ["yuvplot.py", "--video_size", "16x8", "--jobs", str(jobs)]
+                    + ["--frames", "all", "metrics", "--diff", infiles[0]]
+                    + infiles[1:]
+                )
+                results[jobs] = dict(yuvplot.get_sources_results(options))
+            self.assertEqual(set(infiles[1:]), set(results[2]))
+            self.assertEqual(results[1], results[2])
+
+    def testTrend(self):
+        """Test the per-frame trend stats, their cache, and their buckets"""
+        rng = np.random.default_rng(0)
+        frames = rng.integers(0, 256, (10, 16 * 8 * 3 // 2)).astype(np.uint8)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            frames.tofile(infile)
+            argv = ["yuvplot.py", "--video_size", "16x8"]
+            # a cold partial run only reads its frames (and does not cache)
+            partial_options = yuvplot.get_options(
+                argv + ["--frames", "2:8:2", "trend", infile]
+            )
+            partial = yuvplot.get_source_trend(partial_options, infile)
+            self.assertFalse(os.path.exists("%s.trend.cache.npz" % infile))
+            options = yuvplot.get_options(argv + ["trend", infile])
+            trend = yuvplot.get_source_trend(options, infile)
+            self.assertTrue(os.path.exists("%s.trend.cache.npz" % infile))
+            cached = yuvplot.get_source_trend(options, infile)
+            cached_partial = yuvplot.get_source_trend(partial_options, infile)
+            for key in trend:
+                np.testing.assert_array_equal(trend[key], cached[key])
+                np.testing.assert_array_equal(trend[key][2:8:2], partial[key])
+                np.testing.assert_array_equal(partial[key], cached_partial[key])
+        ydata = frames[:, :128].astype(np.float64)
+        udata = frames[:, 128:160]
+        np.testing.assert_array_equal(np.arange(10), trend["frame"])
+        np.testing.assert_allclose(ydata.mean(axis=1), trend["y.mean"])
+        np.testing.assert_allclose(ydata.std(axis=1), trend["y.std"])
+        np.testing.assert_array_equal(ydata.min(axis=1), trend["y.min"])
+        np.testing.assert_array_equal(ydata.max(axis=1), trend["y.max"])
+        np.testing.assert_array_equal((udata < 16).sum(axis=1), trend["u.below"])
+        np.testing.assert_array_equal((udata > 240).sum(axis=1), trend["u.above"])
+        # buckets of 5 frames
+        buckets = yuvplot.get_trend_buckets(trend, 2)
+        np.testing.assert_array_equal([0, 5], buckets["frame"])
+        np.testing.assert_allclose(ydata.reshape(2, -1).std(axis=1), buckets["y.std"])
+        np.testing.assert_array_equal(
+            ydata.reshape(2, -1).min(axis=1), buckets["y.min"]
+        )
+
+    def testBlocks(self):
+        """Test the per-block stats against a per-block loop"""
+        rng = np.random.default_rng(0)
+        width, height = 40, 24
+        frames = rng.integers(0, 256, (2, width * height * 3 // 2)).astype(np.uint8)
+        ref = rng.integers(0, 256, (2, width * height * 3 // 2)).astype(np.uint8)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            reffile = os.path.join(tmpdir, "ref.yuv")
+            frames.tofile(infile)
+            ref.tofile(reffile)
+            for block_size in (8, 16):
+                options = yuvplot.get_options(
+                    ["yuvplot.py", "--video_size", "%ix%i" % (width, height)]
+                    + ["--frames", "all", "blocks", "--block_size", str(block_size)]
+                    + [infile, "--diff", reffile]
+                )
+                blocks = yuvplot.get_source_blocks(options, infile)
+                # U plane (20x12 samples, padded for 8x8 and 16x16 blocks)
+                offset = width * height
+                udata = frames[:, offset : offset + 240].reshape(2, 12, 20)
+                uref = ref[:, offset : offset + 240].reshape(2, 12, 20)
+                for by in range(-(-12 // block_size)):
+                    for bx in range(-(-20 // block_size)):
+                        window = (
+                            slice(None),
+                            slice(by * block_size, (by + 1) * block_size),
+                            slice(bx * block_size, (bx + 1) * block_size),
+                        )
+                        data = udata[window].astype(np.float64)
+                        diff = data - uref[window]
+                        self.assertAlmostEqual(data.mean(), blocks["u.mean"][by, bx])
+                        self.assertAlmostEqual(data.var(), blocks["u.var"][by, bx])
+                        self.assertAlmostEqual(
+                            np.mean(diff**2), blocks["u.energy"][by, bx]
+                        )
+            # invalid block sizes are rejected
+            for block_size in (0, -8):
+                with self.assertRaises(SystemExit), contextlib.redirect_stderr(
+                    io.StringIO()
+                ):
+                    yuvplot.get_options(
+                        ["yuvplot.py", "blocks", "--block_size", str(block_size)]
+                        + [infile]
+                    )
+
+    def testCensus(self):
+        """Test the census of out-of-range and clipped samples"""
+        width, height = 16, 8
+        frames = np.full((3, width * height * 3 // 2), 128, dtype=np.uint8)
+        frames[1, 3 * width + 5] = 255
+        frames[1, 6 * width + 2] = 10
+        frames[2, width * height + 9] = 0
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, "input.yuv")
+            frames.tofile(infile)
+            options = yuvplot.get_options(
+                ["yuvplot.py", "--quiet", "--video_size", "16x8", "census", infile]
+            )
+            rows = yuvplot.get_source_census(options, infile)
+            self.assertEqual(9, len(rows))
+            bad_rows = [row for row in rows if row["first"] is not None]
+            self.assertEqual(
+                [
+                    {
+                        "frame": 1,
+                        "plane": "y",
+                        "below": 1,
+                        "above": 1,
+                        "clipped0": 0,
+                        "clipped255": 1,
+                        "first": (5, 3),
+                    },
+                    {
+                        "frame": 2,
+                        "plane": "u",
+                        "below": 1,
+                        "above": 0,
+                        "clipped0": 1,
+                        "clipped255": 0,
+                        "first": (1, 1),
+                    },
+                ],
+                bad_rows,
+            )
+            # --frames selects the frames to check
+            options.frames = "2:"
+            rows = yuvplot.get_source_census(options, infile)
+            self.assertEqual([2, 2, 2], [row["frame"] for row in rows])
+            # out-of-range samples make the census fail
+            with self.assertRaises(SystemExit):
+                yuvplot.process_options(options)
+            # census only prints its results
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(
+                io.StringIO()
+            ):
+                yuvplot.get_options(
+                    ["yuvplot.py", "--format", "json", "census", infile]
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()